@@ -1,21 +1,262 @@
 import asyncio as aio
+import threading
+import typing as ty
+from enum import Enum
 import mido
-from janus import Queue
+from xtouchr import tracing
+from xtouchr.recorder import RECORDER
+from xtouchr.metrics import METRICS
 
 class AioMidiQueue:
-    def __init__(self, in_port: mido.ports.BaseInput):
+    """
+    Hands incoming MIDI messages from the port's callback thread over to asyncio.
+
+    Messages are put into a preallocated ring. Putting a message takes no lock
+    unless the ring is full or the event loop waits for messages, which is
+    then woken up through call_soon_threadsafe. When the ring is full, the
+    overflow policy decides what happens:
+
+    DROP_OLDEST drops the oldest queued message,
+    COALESCE_CC replaces a queued value of the same CC with the new one. If
+                there is none, it makes space by dropping a CC value that a
+                later one supersedes, else the oldest CC. Notes are only
+                dropped (oldest first) when no CC is queued, so presses and
+                releases do not get lost to knob turns.
+    BLOCK       blocks the port's thread until there is space again.
+
+    depth, queued, dropped and coalesced tell about the state of the ring.
+
+    In raw mode the queue yields the plain message bytes instead of mido.Message
+    objects. With the rtmidi backend, the callback is installed on the rtmidi
+    port directly so mido does not parse the message at all.
+
+    If tracing is enabled when the queue is created, the arrival time of every
+    message is kept, and last_stamps holds those of the last messages taken.
+    """
+    class Overflow(Enum):
+        DROP_OLDEST = 0
+        COALESCE_CC = 1
+        BLOCK = 2
+
+    def __init__(self, in_port: mido.ports.BaseInput, raw: bool = False, size: int = 256,
+                 overflow: "AioMidiQueue.Overflow" = Overflow.COALESCE_CC):
+        self._raw = raw
+        self._size = size
+        self._overflow = self.Overflow(overflow)
+        self._slots: ty.List[ty.Any] = [None] * size
+        self._head = 0      # Next slot to take, only moved with _lock held
+        self._tail = 0      # Next slot to put, only moved by the port's thread
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._blocked = False
+        self._loop: ty.Optional[aio.AbstractEventLoop] = None
+        self._waiter: ty.Optional[aio.Future] = None
+        self.queued = 0     # Messages put so far, including the dropped and coalesced ones
+        self.dropped = 0
+        self.coalesced = 0
+        METRICS.queues.add(self)
+        self.traced = tracing.TRACER.enabled
+        self._times: ty.List[float] = [0.0] * size if self.traced else []
+        self.last_stamps: ty.List[float] = []
+        self.attach(in_port)
+
+    def attach(self, in_port: mido.ports.BaseInput):
+        """
+        Takes messages from the given port from now on, e.g. after reconnecting
+        """
         self._in_port = in_port
-        self._in_port.callback = self._new_message
-        self._queue: Queue = Queue(256)  # We init this in launch command
+        rt = getattr(self._in_port, '_rt', None)
+        if self._raw and rt is not None:
+            rt.set_callback(self._new_raw)
+        elif self._raw:
+            self._in_port.callback = self._new_bytes
+        else:
+            self._in_port.callback = self._new_message
 
     def _new_message(self, msg: mido.Message):
-        self._queue.sync_q.put(msg)
+        if RECORDER.active:
+            RECORDER.midi_in(msg.bytes())
+        self._put(msg)
+
+    def _new_bytes(self, msg: mido.Message):
+        data = msg.bytes()
+        if RECORDER.active:
+            RECORDER.midi_in(data)
+        self._put(data)
+
+    def _new_raw(self, event: ty.Tuple[ty.List[int], float], _data=None):
+        if RECORDER.active:
+            RECORDER.midi_in(event[0])
+        self._put(event[0])
+
+    def feed(self, data: ty.Sequence[int]):
+        """
+        Puts in a message given as plain bytes, as if it came from the port
+        """
+        if self._raw:
+            self._new_raw((list(data), 0.0))
+        else:
+            self._new_message(mido.Message.from_bytes(data))
+
+    def _put(self, item: ty.Any):
+        t = tracing.now() if self.traced else 0.0
+        self.queued += 1
+        if self._tail - self._head >= self._size:
+            if not self._put_full(item, t):
+                return
+        else:
+            i = self._tail % self._size
+            self._slots[i] = item
+            if self.traced:
+                self._times[i] = t
+            self._tail += 1
+
+        if self._waiter is not None:
+            # Taken under the lock, so only the waiter read here is cleared
+            with self._lock:
+                waiter, self._waiter = self._waiter, None
+            if waiter is not None:
+                self._loop.call_soon_threadsafe(self._wake, waiter)
+
+    def _put_full(self, item: ty.Any, t: float) -> bool:
+        with self._lock:
+            while self._tail - self._head >= self._size:
+                if self._overflow == self.Overflow.BLOCK:
+                    self._blocked = True
+                    self._not_full.wait()
+                    continue
+
+                if self._overflow == self.Overflow.COALESCE_CC:
+                    if self._replace_cc(item, t):
+                        self.coalesced += 1
+                        return False
+                    if self._remove_cc():
+                        continue
+
+                self._slots[self._head % self._size] = None
+                self._head += 1
+                self.dropped += 1
+
+            i = self._tail % self._size
+            self._slots[i] = item
+            if self.traced:
+                self._times[i] = t
+            self._tail += 1
+        return True
+
+    def _cc_key(self, item: ty.Any) -> ty.Optional[ty.Tuple[int, int]]:
+        if self._raw:
+            if len(item) == 3 and (item[0] & 0xF0) == 0xB0:
+                return (item[0], item[1])
+        elif item.type == 'control_change':
+            return (item.channel, item.control)
+        return None
+
+    def _replace_cc(self, item: ty.Any, t: float) -> bool:
+        key = self._cc_key(item)
+        if key is None:
+            return False
+
+        for n in range(self._tail - 1, self._head - 1, -1):
+            i = n % self._size
+            if self._cc_key(self._slots[i]) == key:
+                self._slots[i] = item
+                if self.traced:
+                    self._times[i] = t
+                return True
+        return False
+
+    def _remove_cc(self) -> bool:
+        # Frees a slot by removing a superseded CC value, else the oldest CC
+        seen = set()
+        oldest = None
+        for n in range(self._tail - 1, self._head - 1, -1):
+            key = self._cc_key(self._slots[n % self._size])
+            if key is None:
+                continue
+            if key in seen:
+                self.coalesced += 1
+                self._remove(n)
+                return True
+            seen.add(key)
+            oldest = n
+        if oldest is None:
+            return False
+        self.dropped += 1
+        self._remove(oldest)
+        return True
+
+    def _remove(self, n: int):
+        # Moves the messages before n up by one, called with _lock held
+        for m in range(n, self._head, -1):
+            i = m % self._size
+            j = (m - 1) % self._size
+            self._slots[i] = self._slots[j]
+            if self.traced:
+                self._times[i] = self._times[j]
+        self._slots[self._head % self._size] = None
+        self._head += 1
+
+    @staticmethod
+    def _wake(waiter: aio.Future):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    async def _wait(self):
+        if self._loop is None:
+            self._loop = aio.get_running_loop()
+        while True:
+            # The ring is only found empty and the waiter installed together,
+            # a put after that sees the waiter and takes it under the lock
+            with self._lock:
+                if self._tail != self._head:
+                    return
+                waiter = self._loop.create_future()
+                self._waiter = waiter
+            await waiter
+
+    def _take(self, count: int) -> ty.List[ty.Any]:
+        with self._lock:
+            head = self._head
+            count = min(count, self._tail - head)
+            items = []
+            stamps = []
+            for n in range(head, head + count):
+                i = n % self._size
+                items.append(self._slots[i])
+                self._slots[i] = None
+                if self.traced:
+                    stamps.append(self._times[i])
+            self._head = head + count
+            if self._blocked:
+                self._blocked = False
+                self._not_full.notify()
+        self.last_stamps = stamps
+        return items
+
+    @property
+    def name(self) -> str:
+        # Of the port messages are taken from
+        return self._in_port.name
+
+    @property
+    def depth(self) -> int:
+        return self._tail - self._head
 
     async def get(self) -> mido.Message:
-        return await self._queue.async_q.get()
+        await self._wait()
+        return self._take(1)[0]
+
+    async def get_batch(self) -> ty.List[mido.Message]:
+        """
+        Waits for at least one message and then drains everything else that is
+        already queued without waiting any further.
+        """
+        await self._wait()
+        return self._take(self._size)
 
     def __aiter__(self):
         return self
 
     async def __anext__(self) -> mido.Message:
-        return await self.get()
\ No newline at end of file
+        return await self.get()
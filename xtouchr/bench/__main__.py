@@ -0,0 +1,132 @@
+"""
+Runs the benchmark scenarios offline, without MIDI backend or network:
+
+    python -m xtouchr.bench [--save results.json] [--compare baseline.json] [scenario ...]
+
+With --replay, the incoming traffic of a recorded log is replayed instead
+(see xtouchr.recorder), at --speed times the original speed or, with 0, as
+fast as possible.
+
+Every scenario reports how many MIDI messages were fed, dispatched to the
+controls, coalesced (within a dispatch batch or on queue overflow) and
+dropped, and the latency from their arrival in the input queue to their
+dispatch (midi->dispatch). The midi->osc and midi->midi latencies only cover
+sends made while dispatching, sends deferred to the OSC rate limit or the
+MIDI frame timer are not attributed to any event.
+"""
+import argparse
+import asyncio as aio
+import json
+import platform
+import time
+import tracemalloc
+import typing as ty
+from xtouchr.tracing import TRACER
+from xtouchr.metrics import METRICS
+from xtouchr.bench.scenarios import SCENARIOS, Surface, replay
+
+
+async def run_scenario(scenario: ty.Callable[[Surface], ty.Awaitable[int]], measure_alloc: bool) -> ty.Dict[str, ty.Any]:
+    TRACER.reset()
+    surface = Surface()
+    surface.start()
+    await surface.settle()
+    midi_out = len(surface.midi_out.sent)
+    osc_out = len(surface.osc.packets)
+    queue = surface.device.queue_in
+    queued, dropped = queue.queued, queue.dropped
+    METRICS.reset()
+
+    if measure_alloc:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    events = await scenario(surface)
+    elapsed = time.perf_counter() - t0
+    queued = queue.queued - queued
+    dropped = queue.dropped - dropped
+    dispatched = sum(METRICS.midi_in.values())
+    result = {
+        'events': events,
+        'seconds': elapsed,
+        'events_per_sec': events / elapsed if elapsed else 0.0,
+        'midi_fed': queued,
+        'midi_dispatched': dispatched,
+        'dispatched_per_sec': dispatched / elapsed if elapsed else 0.0,
+        # On overflow and in batches
+        'midi_coalesced': queued - dropped - dispatched,
+        'midi_dropped': dropped,
+        'osc_in': sum(METRICS.osc_in.values()),
+        'midi_out': len(surface.midi_out.sent) - midi_out,
+        'osc_packets_out': len(surface.osc.packets) - osc_out,
+        'latency': TRACER.snapshot(),
+    }
+    if measure_alloc:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['alloc_peak_bytes'] = peak
+
+    await surface.close()
+    return result
+
+
+async def run(scenarios: ty.Dict[str, ty.Callable[[Surface], ty.Awaitable[int]]]) -> ty.Dict[str, ty.Any]:
+    TRACER.enable()
+    # Counts what was actually dispatched
+    METRICS.enable()
+    results = {}
+    for name, scenario in scenarios.items():
+        # Timing and allocations are measured in separate runs, tracemalloc is slow
+        result = await run_scenario(scenario, False)
+        result['alloc_peak_bytes'] = (await run_scenario(scenario, True))['alloc_peak_bytes']
+        results[name] = result
+    return results
+
+
+def report(results: ty.Dict[str, ty.Any], baseline: ty.Optional[ty.Dict[str, ty.Any]]):
+    for name, r in results.items():
+        print(f"{name}: {r['events']} events in {r['seconds']*1e3:.1f}ms, {r['events_per_sec']:.0f} events/s, "
+              f"{r['midi_out']} MIDI out, {r['osc_packets_out']} OSC packets out, "
+              f"peak alloc {r['alloc_peak_bytes']/1024:.1f}KiB")
+        print(f"    MIDI in: {r['midi_fed']} fed, {r['midi_dispatched']} dispatched, "
+              f"{r['midi_coalesced']} coalesced, {r['midi_dropped']} dropped ({r['dispatched_per_sec']:.0f} dispatched/s); "
+              f"OSC in: {r['osc_in']}")
+        for path, s in sorted(r['latency'].items()):
+            print(f"    {path}: n={s['count']} p50<={s['p50']*1e6:.0f}us p90<={s['p90']*1e6:.0f}us "
+                  f"p99<={s['p99']*1e6:.0f}us max={s['max']*1e6:.0f}us")
+
+        if baseline and name in baseline:
+            b = baseline[name]
+            print(f"    vs. baseline: {r['events_per_sec'] / b['events_per_sec']:.2f}x events/s, "
+                  f"{r['alloc_peak_bytes'] / max(b['alloc_peak_bytes'], 1):.2f}x peak alloc")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline xtouchr benchmarks")
+    parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run, one of {', '.join(SCENARIOS)}")
+    parser.add_argument('--save', help="Write the results as JSON to this file")
+    parser.add_argument('--compare', help="Compare against results saved earlier")
+    parser.add_argument('--replay', help="Replay a recorded traffic log")
+    parser.add_argument('--speed', type=float, default=0.0, help="Replay speed, 0 is as fast as possible")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    if args.replay:
+        scenarios = {f"replay:{args.replay}": lambda surface: replay(surface, args.replay, args.speed)}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in (args.scenarios or SCENARIOS)}
+    results = aio.run(run(scenarios))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'time': time.time(), 'python': platform.python_version(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import typing as ty
+import aiosc
+import mido
+from xtouchr.oscbatcher import BatchingOSCProtocol
+
+
+class FakeMidiInput:
+    """
+    In-memory stand-in for a mido input port. Messages are delivered to the
+    port's callback with feed, like the MIDI backend thread would do.
+    """
+    def __init__(self, name: str = 'fake-in'):
+        self.name = name
+        self.callback: ty.Optional[ty.Callable] = None
+
+    def feed(self, msg: mido.Message):
+        self.callback(msg)
+
+
+class FakeMidiOutput:
+    """
+    In-memory stand-in for a mido output port that records every sent message
+    """
+    def __init__(self, name: str = 'fake-out'):
+        self.name = name
+        self.sent: ty.List[mido.Message] = []
+
+    def send(self, msg: mido.Message):
+        self.sent.append(msg)
+
+
+class FakeTransport:
+    """
+    Datagram transport that records all packets instead of sending them
+    """
+    def __init__(self):
+        self.packets: ty.List[bytes] = []
+
+    def sendto(self, data: bytes, addr=None):
+        self.packets.append(data)
+
+    def close(self):
+        pass
+
+
+class FakeOSCProtocol(BatchingOSCProtocol):
+    """
+    OSC protocol on a FakeTransport. Incoming messages from the DAW are
+    simulated with inject, which goes through the regular packet parsing.
+    """
+    DAW_ADDR = ('127.0.0.1', 3819)
+
+    def __init__(self):
+        super().__init__()
+        self.transport = FakeTransport()
+
+    @property
+    def packets(self) -> ty.List[bytes]:
+        return self.transport.packets
+
+    def inject(self, path: str, *args):
+        self.datagram_received(aiosc.pack_message(path, *args), self.DAW_ADDR)
@@ -0,0 +1,141 @@
+import asyncio as aio
+import math
+import time
+import typing as ty
+import mido
+from xtouchr.mididevice import MidiDevice
+from xtouchr.dawcontrols import ArdourStripFaderControl
+from xtouchr.timers import TIMERS
+from xtouchr.xtouch_demo import build_surface
+from xtouchr.bench.fakes import FakeMidiInput, FakeMidiOutput, FakeOSCProtocol
+from xtouchr.recorder import Replayer
+
+STRIPS = range(1, 9)
+CHANNEL = 10
+# Fed messages are held back while this many are waiting in the input queue,
+# like a real device over a MIDI cable never outpaces the dispatcher
+MAX_DEPTH = 32
+FRAME_RATE = 60.0
+
+
+class Surface:
+    """
+    The demo's control graph, wired to fake MIDI ports and a fake OSC transport
+    """
+    def __init__(self):
+        self.midi_in = FakeMidiInput()
+        self.midi_out = FakeMidiOutput()
+        self.device = MidiDevice(self.midi_in, self.midi_out, batch=True, raw=True, frame_rate=FRAME_RATE)
+        self.osc = FakeOSCProtocol()
+        self.mapping, self.controls = build_surface(self.device, self.osc)
+        self._task: ty.Optional[aio.Task] = None
+
+    def start(self):
+        self._task = aio.get_running_loop().create_task(self.device.start())
+
+    async def close(self):
+        """
+        Stops dispatching and cancels all timers, so nothing of this surface
+        runs during the next scenario
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await aio.gather(self._task, return_exceptions=True)
+            self._task = None
+        TIMERS.cancel_all()
+        # Let handles that were already due run out
+        await aio.sleep(0)
+        await aio.sleep(0)
+
+    async def feed_midi(self, msgs: ty.Sequence[mido.Message], max_depth: int = MAX_DEPTH):
+        """
+        Feeds the messages from another thread, like the MIDI backend does,
+        paced to keep at most max_depth messages in the input queue, and
+        waits until all of them were dispatched
+        """
+        await aio.get_running_loop().run_in_executor(None, self._feed, msgs, max_depth)
+        await self.settle()
+
+    def _feed(self, msgs: ty.Sequence[mido.Message], max_depth: int):
+        queue = self.device.queue_in
+        for msg in msgs:
+            while queue.depth >= max_depth:
+                time.sleep(0.0001)
+            self.midi_in.feed(msg)
+
+    async def settle(self):
+        while self.device.queue_in.depth:
+            await aio.sleep(0)
+        # Let the dispatcher and the OSC batcher finish their iteration
+        await aio.sleep(0)
+        await aio.sleep(0)
+
+
+async def fader_sweep(surface: Surface, rounds: int = 20) -> int:
+    """
+    Sweeps all eight encoders up and down at once
+    """
+    msgs = []
+    for r in range(rounds):
+        values = range(128) if r % 2 == 0 else range(127, -1, -1)
+        for value in values:
+            for strip in STRIPS:
+                msgs.append(mido.Message('control_change', channel=CHANNEL, control=strip, value=value))
+    await surface.feed_midi(msgs)
+    return len(msgs)
+
+
+async def solo_mute_storm(surface: Surface, rounds: int = 200) -> int:
+    """
+    Taps all solo/mute buttons while the DAW toggles mute and solo states
+    """
+    events = 0
+    for r in range(rounds):
+        msgs = []
+        for strip in STRIPS:
+            msgs.append(mido.Message('note_on', channel=CHANNEL, note=7+strip, velocity=127))
+            msgs.append(mido.Message('note_off', channel=CHANNEL, note=7+strip, velocity=0))
+        await surface.feed_midi(msgs)
+        for strip in STRIPS:
+            surface.osc.inject('/strip/mute', strip, float(r % 2))
+            surface.osc.inject('/strip/solo', strip, float((r // 2) % 2))
+        surface.osc.inject('/cancel_all_solos', float((r // 2) % 2))
+        events += len(msgs) + 2 * len(STRIPS) + 1
+        await surface.settle()
+    return events
+
+
+async def automation_feedback(surface: Surface, packets: int = 4000) -> int:
+    """
+    Streams fader, trim and pan automation for all strips from the DAW
+    """
+    rounds = packets // (3 * len(STRIPS))
+    for i in range(rounds):
+        for strip in STRIPS:
+            phase = i / 50.0 + strip
+            surface.osc.inject('/strip/fader', strip, 0.5 + 0.5 * math.sin(phase))
+            surface.osc.inject('/strip/trimdB', strip, 20.0 * math.sin(phase / 2.0))
+            surface.osc.inject('/strip/pan_stereo_position', strip, 0.5 + 0.5 * math.cos(phase))
+        if i % 16 == 0:
+            await surface.settle()
+    await surface.settle()
+    # The trailing LED ring update and the frame it goes out with
+    await aio.sleep(1.0 / ArdourStripFaderControl.FEEDBACK_RATE + 1.0 / FRAME_RATE)
+    await surface.settle()
+    return rounds * 3 * len(STRIPS)
+
+
+async def replay(surface: Surface, path: str, speed: float = 0.0) -> int:
+    """
+    Replays the incoming traffic of a recorded session
+    """
+    events = await Replayer(surface.device, surface.osc).replay(path, speed)
+    await surface.settle()
+    return events
+
+
+SCENARIOS: ty.Dict[str, ty.Callable[[Surface], ty.Awaitable[int]]] = {
+    'fader_sweep': fader_sweep,
+    'solo_mute_storm': solo_mute_storm,
+    'automation_feedback': automation_feedback,
+}
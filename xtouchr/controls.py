@@ -1,16 +1,26 @@
 import abc
 import typing as ty
-import asyncio as aio
+from xtouchr.metrics import METRICS
+from xtouchr.profiler import PROFILER
 
 CT = ty.TypeVar('CT')
 
 class MaybeNotify:
+    """
+    Collects changed states of a control and notifies its listeners once about
+    all of them. Every control keeps one of these and reuses it, including the
+    change set, so unchanged writes don't allocate anything. The change set is
+    cleared after the listeners were called, listeners must not keep it.
+    """
+    __slots__ = ('_ctrl', '_notes', 'active')
+
     def __init__(self, ctrl: "Control"):
         self._ctrl = ctrl
-        self._notes = None
+        self._notes = dict()
+        self.active = False
 
     def __enter__(self):
-        self._notes = dict()
+        self.active = True
         return self
 
     def assign(self, old: CT, new: CT, oid: ty.Hashable) -> CT:
@@ -20,19 +30,33 @@ class MaybeNotify:
         return new
 
     def __exit__(self, *args):
-        if self._notes:
-            self._ctrl.notify(self._notes)
+        try:
+            if self._notes:
+                self._ctrl.notify(self._notes)
+        finally:
+            self._notes.clear()
+            self.active = False
 
 
 class Control(abc.ABC):
+    __slots__ = ('listeners', '_notifier')
+
     def __init__(self):
         self.listeners = list()
+        self._notifier = MaybeNotify(self)
 
     def register(self, listener: ty.Callable):
         self.listeners.append(listener)
 
+    def unregister(self, listener: ty.Callable):
+        self.listeners.remove(listener)
+
     def notify(self, *args):
-        loop = aio.get_running_loop()
+        if METRICS.enabled:
+            METRICS.count(METRICS.notify, type(self))
+        if PROFILER.enabled:
+            PROFILER.notify(self, args)
+            return
         for l in self.listeners:
             l(*args)
             
@@ -51,4 +75,7 @@ class Control(abc.ABC):
         dictionary. After exiting the with-scope, a change notification is triggered only
         if something has actually changed and then only those values that did actually change.
         """
-        return MaybeNotify(self)
\ No newline at end of file
+        if self._notifier.active:
+            # A listener changes us while we notify, this needs its own change set
+            return MaybeNotify(self)
+        return self._notifier
@@ -4,10 +4,25 @@ from xtouchr.controls import Control
 import abc
 import typing as ty
 from enum import Enum
-import asyncio as aio
+from xtouchr.timers import Timer, RepeatingTimer
+from xtouchr.linkhealth import LinkHealth
+from xtouchr.oscrouter import OSCRouter
+
+
+# What the LED ring shows of a strip's fader, trim (in dB) and stereo position
+def fader_ring(val: float) -> int:
+    return int(127.9 * val)
+
+def trim_ring(val: float) -> int:
+    return int(127.9 * (val + 20.0) / 40.0)
+
+def stereo_pos_ring(val: float) -> int:
+    return int(127.9 * (1.0 - val))
 
 
 class DAWToggleSetOnly(Control):
+    __slots__ = ('_button', '_osc')
+
     def __init__(self, button: mc.LEDButton, osc: osc.OSCToggleSetOnly):
         super().__init__()
         self._button = button
@@ -26,6 +41,8 @@ class DAWToggleSetOnly(Control):
             self._button.led = self._button.LED.ON if data['on'] else self._button.LED.OFF
 
 class DAWMainFader(Control):
+    __slots__ = ('fader', 'osc')
+
     def __init__(self, fader: mc.Fader, osc: osc.OSCFader):
         super().__init__()
         self.fader = fader
@@ -36,8 +53,13 @@ class DAWMainFader(Control):
         self.osc.value = self.fader.value / 127.0
 
 class ArdourStripFaderControl(Control):
+    __slots__ = ('fader', 'fader_button', 'osc_fader', 'osc_trim', 'osc_stereo_pos', 'osc_recenable',
+                 '_property', '_rec_longpress_timer', '_recenable_reshow_timer')
+
     RECENABLE_TIME = 1.0
     LONGPRESS_TIME = 0.5
+    OSC_RATE = 30.0     # Max. values per second sent to the DAW per OSC fader
+    FEEDBACK_RATE = 30.0    # Max. LED ring updates per second from DAW feedback
 
     class Property(Enum):
         FADER = 0
@@ -61,17 +83,46 @@ class ArdourStripFaderControl(Control):
         # My own state
         self._property = self.Property.FADER    # Which strip control is edited/shown on the fader
         self.fader.mode = self.fader.Mode.FAN
-        self._rec_longpress_timer = None
-        self._recenable_reshow_timer = None
+        self._rec_longpress_timer = Timer(self._longpress)
+        self._recenable_reshow_timer = Timer(self._set_recenable)
         self._register_callbacks()
 
     def _register_callbacks(self):
         self.fader.register(self.midi_fader_cb)
         self.fader_button.register(self.midi_fader_button_cb)
+        self._register_osc_callbacks()
+
+    def _register_osc_callbacks(self):
         self.osc_fader.register(self.osc_fader_cb)
         self.osc_trim.register(self.osc_trim_cb)
         self.osc_stereo_pos.register(self.osc_stereo_pos_cb)
         self.osc_recenable.register(self.osc_recenable_cb)
+
+    def _unregister_osc_callbacks(self):
+        self.osc_fader.unregister(self.osc_fader_cb)
+        self.osc_trim.unregister(self.osc_trim_cb)
+        self.osc_stereo_pos.unregister(self.osc_stereo_pos_cb)
+        self.osc_recenable.unregister(self.osc_recenable_cb)
+
+    def bind(self,
+             osc_fader: osc.OSCFader,
+             osc_trim: osc.OSCFader,
+             osc_stereo_pos: osc.OSCFader,
+             osc_recenable: osc.OSCToggle):
+        """
+        Moves the fader over to another strip's OSC controls and shows their
+        current state. Only what actually differs is sent to the device.
+        """
+        self._unregister_osc_callbacks()
+        self.osc_fader = osc_fader
+        self.osc_trim = osc_trim
+        self.osc_stereo_pos = osc_stereo_pos
+        self.osc_recenable = osc_recenable
+        self._register_osc_callbacks()
+        self._rec_longpress_timer.cancel()
+        self._recenable_reshow_timer.cancel()
+        self._show()
+        self.osc_recenable_cb({'on': self.osc_recenable.on})
     
     def midi_fader_cb(self, notes: dict):
         if ('value' in notes):
@@ -88,51 +139,54 @@ class ArdourStripFaderControl(Control):
     def midi_fader_button_cb(self, notes: dict):
         if notes['pressed']:
             # Button was just pressed, start longpress timer
-            if self._rec_longpress_timer:
-                self._rec_longpress_timer.cancel()
-
-            self._rec_longpress_timer = aio.get_running_loop().call_later(self.LONGPRESS_TIME, self._longpress)
+            self._rec_longpress_timer.start(self.LONGPRESS_TIME)
         else:
             # Button was released, if longpress timer not expired, we handle it here
-            if not self._rec_longpress_timer:
+            if not self._rec_longpress_timer.active:
                 return
             
             self._rec_longpress_timer.cancel()
-            self._rec_longpress_timer = None
 
             if self._property == self._property.FADER:
-                self.fader.mode = self.fader.mode.PAN
-                self.fader.value = int(127.9 * (1.0 - self.osc_stereo_pos.value))
                 self._property = self._property.STEREO_POS
             elif self._property == self._property.STEREO_POS:
-                self.fader.mode = self.fader.mode.TRIM
-                self.fader.value = int(127.9 * (self.osc_trim.value + 20.0) / 40.0)
                 self._property = self._property.TRIM
             elif self._property == self._property.TRIM:
-                self.fader.mode = self.fader.mode.FAN
-                self.fader.value = int(127.9 * self.osc_fader.value)
                 self._property = self._property.FADER
+            self._show()
             self._possibly_recenable_timer()
+
+    def _show(self):
+        # Shows the currently edited property on the fader
+        if self._property == self.Property.FADER:
+            self.fader.mode = self.fader.Mode.FAN
+            self.fader.value = fader_ring(self.osc_fader.value)
+        elif self._property == self.Property.STEREO_POS:
+            self.fader.mode = self.fader.Mode.PAN
+            self.fader.value = stereo_pos_ring(self.osc_stereo_pos.value)
+        elif self._property == self.Property.TRIM:
+            self.fader.mode = self.fader.Mode.TRIM
+            self.fader.value = trim_ring(self.osc_trim.value)
     
     def osc_fader_cb(self, notes: dict):
         # Are we on the fader?
         if self._property == self.Property.FADER:
             # Pass the value through
-            self.fader.value = int(127.9 * notes['value'])
+            self.fader.feedback(fader_ring(notes['value']))
             self._possibly_recenable_timer()
 
     def osc_trim_cb(self, notes: dict):
         # Are we on the trim?
         if self._property == self.Property.TRIM:
             # Pass the value through
-            self.fader.value = int(127.9 * (notes['value'] + 20.0) / 40.0)
+            self.fader.feedback(trim_ring(notes['value']))
             self._possibly_recenable_timer()
 
     def osc_stereo_pos_cb(self, notes: dict):
         # Are we on stereo pos?
         if self._property == self.Property.STEREO_POS:
             # Pass the value through
-            self.fader.value = int(127.9 * (1.0 - notes['value']))
+            self.fader.feedback(stereo_pos_ring(notes['value']))
             self._possibly_recenable_timer()
 
     def osc_recenable_cb(self, notes: dict):
@@ -145,33 +199,34 @@ class ArdourStripFaderControl(Control):
 
     def _possibly_recenable_timer(self):
         if self.osc_recenable.on:
-            if self._recenable_reshow_timer is not None:
-                self._recenable_reshow_timer.cancel()
-
-            self._recenable_reshow_timer = aio.get_running_loop().call_later(self.RECENABLE_TIME, self._set_recenable)
+            # Pushes the deadline out if already running
+            self._recenable_reshow_timer.start(self.RECENABLE_TIME)
 
     def _set_recenable(self):
         if self.osc_recenable.on:
             self.fader.led = self.fader.LED.BLINKING
-        self._recenable_reshow_timer = None
 
     def _longpress(self):
         self.osc_recenable.on = not self.osc_recenable.on
-        self._rec_longpress_timer = None
 
     @staticmethod
     def build(mididev: "mididevice.Device", oscdev: "aiosc.OSCProtocol", midi_strip_id: int, osc_strip_id: int) -> "ArdourStripControl":
-        fader = mc.LEDFader(mididev, midi_strip_id, midi_strip_id)
+        fader = mc.LEDFader(mididev, midi_strip_id, midi_strip_id,
+                            feedback_rate=ArdourStripFaderControl.FEEDBACK_RATE)
         fader_button = mc.Button(mididev, midi_strip_id-1)
-        osc_fader = osc.OSCFader(oscdev, '/strip/fader', osc_strip_id)
-        osc_trim = osc.OSCFader(oscdev, '/strip/trimdB', osc_strip_id)
-        osc_stereo_pos = osc.OSCFader(oscdev, '/strip/pan_stereo_position', osc_strip_id)
+        rate = ArdourStripFaderControl.OSC_RATE
+        osc_fader = osc.OSCFader(oscdev, '/strip/fader', osc_strip_id, rate=rate, quantize=fader_ring)
+        osc_trim = osc.OSCFader(oscdev, '/strip/trimdB', osc_strip_id, rate=rate, quantize=trim_ring)
+        osc_stereo_pos = osc.OSCFader(oscdev, '/strip/pan_stereo_position', osc_strip_id, rate=rate,
+                                      quantize=stereo_pos_ring)
         osc_recenable = osc.OSCToggle(oscdev, '/strip/recenable', osc_strip_id)
         return ArdourStripFaderControl(fader, fader_button, osc_fader, osc_trim,
                                 osc_stereo_pos, osc_recenable)
 
 
 class ArdourSoloMuteControl(Control):
+    __slots__ = ('led_button', 'osc_mute', 'osc_solo', 'cancel_all_solos', 'osc_group', '_longpress_timer')
+
     LONGPRESS_TIME = 0.3
 
     def __init__(self, led_button: mc.LEDButton,
@@ -187,7 +242,7 @@ class ArdourSoloMuteControl(Control):
         self.osc_group = osc_group
         # My own state
         self.led_button.led = self.led_button.LED.OFF
-        self._longpress_timer = None
+        self._longpress_timer = Timer(self._longpress)
         self._register_callbacks()
 
     def _register_callbacks(self):
@@ -197,20 +252,32 @@ class ArdourSoloMuteControl(Control):
         self.osc_group.register(self.recalculate)
         self.cancel_all_solos.register(self.recalculate)
 
+    def bind(self, osc_mute: osc.OSCToggle, osc_solo: osc.OSCToggle, osc_group: osc.OSCValue):
+        """
+        Moves the button over to another strip's OSC controls and shows their
+        current state
+        """
+        self.osc_mute.unregister(self.recalculate)
+        self.osc_solo.unregister(self.recalculate)
+        self.osc_group.unregister(self.recalculate)
+        self.osc_mute = osc_mute
+        self.osc_solo = osc_solo
+        self.osc_group = osc_group
+        self.osc_mute.register(self.recalculate)
+        self.osc_solo.register(self.recalculate)
+        self.osc_group.register(self.recalculate)
+        self._longpress_timer.cancel()
+        self.recalculate()
+
     def led_button_cb(self, notes: dict):
         if 'pressed' in notes:
             if notes['pressed']:
                 # Button was just pressed, start longpress timer
-                if self._longpress_timer:
-                    self._longpress_timer.cancel()
-
-                # Only start timer if not soloing
-                self._longpress_timer = aio.get_running_loop().call_later(self.LONGPRESS_TIME, self._longpress)
+                self._longpress_timer.start(self.LONGPRESS_TIME)
             else:
                 # Button was released, if longpress timer not expired, we handle it here
-                if self._longpress_timer:
+                if self._longpress_timer.active:
                     self._longpress_timer.cancel()
-                    self._longpress_timer = None
 
                     # If we were soloing, just disable the solo
                     if self.osc_solo.on:
@@ -226,7 +293,8 @@ class ArdourSoloMuteControl(Control):
         is_soloing = self.osc_solo.on
         is_weak_muted = self.cancel_all_solos.on
         is_strong_muted = self.osc_mute.on
-        is_inactive = self.osc_group.value == 'none'
+        # Strips past the session's tracks never get /strip/group
+        is_inactive = self.osc_group.value in (None, 'none')
 
         if is_inactive:
             # There is no track under this strip, always OFF
@@ -246,7 +314,6 @@ class ArdourSoloMuteControl(Control):
 
     def _longpress(self):
         # Toggle soloing here
-        self._longpress_timer = None
         if self.osc_mute.on and not self.osc_solo.on:
             self.osc_solo.on = True
             self.osc_mute.on = False
@@ -264,12 +331,141 @@ class ArdourSoloMuteControl(Control):
         osc_group = osc.OSCValue(oscdev, '/strip/group', osc_strip_id)
         return ArdourSoloMuteControl(led_button, osc_mute, osc_solo, osc_cancel_all_solos, osc_group)
 
+class ArdourStrip:
+    """
+    OSC controls of a single Ardour strip. They keep track of the strip's
+    state from the DAW's feedback, also while it is not shown on the surface.
+    """
+    __slots__ = ('fader', 'trim', 'stereo_pos', 'recenable', 'mute', 'solo', 'group')
+
+    # Paths of the controls, each is routed with the strip id as argument
+    PATHS = ('/strip/fader', '/strip/trimdB', '/strip/pan_stereo_position', '/strip/recenable',
+             '/strip/mute', '/strip/solo', '/strip/group')
+
+    def __init__(self, oscdev: "aiosc.OSCProtocol", osc_strip_id: int):
+        rate = ArdourStripFaderControl.OSC_RATE
+        # Feedback only gets through to the strip controls if it changes the LED ring
+        self.fader = osc.OSCFader(oscdev, '/strip/fader', osc_strip_id, rate=rate, quantize=fader_ring)
+        self.trim = osc.OSCFader(oscdev, '/strip/trimdB', osc_strip_id, rate=rate, quantize=trim_ring)
+        self.stereo_pos = osc.OSCFader(oscdev, '/strip/pan_stereo_position', osc_strip_id, rate=rate,
+                                       quantize=stereo_pos_ring)
+        self.recenable = osc.OSCToggle(oscdev, '/strip/recenable', osc_strip_id)
+        self.mute = osc.OSCToggle(oscdev, '/strip/mute', osc_strip_id)
+        self.solo = osc.OSCToggle(oscdev, '/strip/solo', osc_strip_id)
+        self.group = osc.OSCValue(oscdev, '/strip/group', osc_strip_id)
+
+
+class ArdourBank(Control):
+    """
+    Pages the surface's strips through all Ardour strips. Ardour needs to send
+    feedback for all strips for this, i.e. /set_surface with a bank size of 0.
+
+    The state of every strip is kept in its ArdourStrip, so switching banks
+    just rebinds the strip controls and sends the MIDI messages for whatever
+    differs on the surface, flushed at once.
+    """
+    __slots__ = ('mididev', 'faders', 'solos', 'strips', 'bank_down', 'bank_up', '_bank')
+
+    def __init__(self,
+                 mididev: "mididevice.MidiDevice",
+                 faders: ty.Sequence[ArdourStripFaderControl],
+                 solos: ty.Sequence[ArdourSoloMuteControl],
+                 strips: ty.Sequence[ArdourStrip],
+                 bank_down: mc.LEDButton,
+                 bank_up: mc.LEDButton):
+        super().__init__()
+        self.mididev = mididev
+        self.faders = faders
+        self.solos = solos
+        self.strips = strips
+        self.bank_down = bank_down
+        self.bank_up = bank_up
+        self._bank = 0
+        self.bank_down.register(self._bank_down_cb)
+        self.bank_up.register(self._bank_up_cb)
+        self._show()
+
+    @property
+    def banks(self) -> int:
+        return len(self.strips) // len(self.faders)
+
+    @property
+    def bank(self) -> int:
+        return self._bank
+
+    @bank.setter
+    def bank(self, val: int):
+        val = max(0, min(val, self.banks - 1))
+        if (self._bank != val):
+            with self.maybe_notify() as m:
+                self._bank = m.assign(self._bank, val, 'bank')
+            self._show()
+        self._show_buttons()
+
+    def _bank_down_cb(self, notes: dict):
+        if notes.get('pressed'):
+            self.bank -= 1
+        self._show_buttons()
+
+    def _bank_up_cb(self, notes: dict):
+        if notes.get('pressed'):
+            self.bank += 1
+        self._show_buttons()
+
+    def _show(self):
+        first = self._bank * len(self.faders)
+        for i, (fader, solo) in enumerate(zip(self.faders, self.solos)):
+            strip = self.strips[first + i]
+            fader.bind(strip.fader, strip.trim, strip.stereo_pos, strip.recenable)
+            solo.bind(strip.mute, strip.solo, strip.group)
+        self._show_buttons()
+        self.mididev.flush()
+
+    def _show_buttons(self):
+        # Bank buttons are lit if there is a bank in their direction
+        self.bank_down.led = self.bank_down.LED.ON if self._bank > 0 else self.bank_down.LED.OFF
+        self.bank_up.led = self.bank_up.LED.ON if self._bank < self.banks - 1 else self.bank_up.LED.OFF
+
+    @staticmethod
+    def build(mididev: "mididevice.MidiDevice", oscdev: "aiosc.OSCProtocol", num_strips: int,
+              fader_ccs: ty.Sequence[int] = range(1, 9),
+              fader_buttons: ty.Sequence[int] = range(0, 8),
+              solo_notes: ty.Sequence[int] = range(8, 16),
+              solo_leds: ty.Sequence[int] = range(0, 8),
+              bank_down: ty.Tuple[int, int] = (16, 8),
+              bank_up: ty.Tuple[int, int] = (17, 9),
+              feedback_rate: ty.Optional[float] = ArdourStripFaderControl.FEEDBACK_RATE) -> "ArdourBank":
+        """
+        Builds the bank for num_strips Ardour strips. The surface's strips
+        are laid out by fader_ccs, fader_buttons, solo_notes and solo_leds,
+        the bank buttons are given as (note, LED note). feedback_rate caps the
+        LED ring updates per fader.
+        """
+        width = len(fader_ccs)
+        num_strips = -(-num_strips // width) * width     # Whole banks only
+        strips = [ArdourStrip(oscdev, i) for i in range(1, num_strips + 1)]
+        cancel_all_solos = osc.OSCToggle(oscdev, '/cancel_all_solos')
+        faders = []
+        solos = []
+        for strip, cc, button, note, led in zip(strips, fader_ccs, fader_buttons, solo_notes, solo_leds):
+            faders.append(ArdourStripFaderControl(mc.LEDFader(mididev, cc, cc, feedback_rate=feedback_rate),
+                                                  mc.Button(mididev, button),
+                                                  strip.fader, strip.trim, strip.stereo_pos, strip.recenable))
+            solos.append(ArdourSoloMuteControl(mc.LEDButton(mididev, note, led),
+                                               strip.mute, strip.solo, cancel_all_solos, strip.group))
+        return ArdourBank(mididev, faders, solos, strips,
+                          mc.LEDButton(mididev, *bank_down), mc.LEDButton(mididev, *bank_up))
+
+
 class ArdourRecordButton(Control):
+    __slots__ = ('led_button', 'osc_rec_enable', 'osc_rec_tally', 'osc_play')
+
     def __init__(self,
                  led_button: mc.LEDButton,
                  osc_rec_enable: osc.OSCToggle,
                  osc_rec_tally: osc.OSCValue,
                  osc_play = osc.OSCValue):
+        super().__init__()
         self.led_button = led_button
         self.osc_rec_enable = osc_rec_enable
         self.osc_rec_tally = osc_rec_tally
@@ -311,6 +507,8 @@ class ArdourRecordButton(Control):
         return ArdourRecordButton(led_button, osc_rec_enable, osc_rec_tally, osc_play)
 
 class ArdourLoopToggle(Control):
+    __slots__ = ('led_button', 'osc_loop')
+
     def __init__(self, led_button: mc.LEDButton, osc_loop: osc.OSCToggle):
         super().__init__()
         self.led_button = led_button
@@ -331,6 +529,8 @@ class ArdourLoopToggle(Control):
             self.led_button.led = self.led_button.LED.OFF
 
 class ArdourJogControl(Control):
+    __slots__ = ('button', 'osc_jog', 'mul', '_timer')
+
     INITIAL = 5.0
     INCREMENT = 4.0
     INITIAL_WAIT = 0.4
@@ -340,43 +540,82 @@ class ArdourJogControl(Control):
         self.button = button
         self.osc_jog = osc_jog
         self.mul = 1.0 if forward else -1.0
-        self._timer = None
+        self._timer = RepeatingTimer(self._incremental)
         self.button.register(self._midi_cb)
 
     def _midi_cb(self, notes: dict):
         if 'pressed' in notes:
             if notes['pressed']:
-                if self._timer is not None:
-                    self._timer.cancel()
-
                 self.osc_jog.action(self.INITIAL * self.mul)
-                self._timer = aio.get_running_loop().call_later(self.INITIAL_WAIT, self._incremental)
+                self._timer.start(self.INITIAL_WAIT, self.INCREMENT_WAIT)
             else:
-                if self._timer is not None:
-                    self._timer.cancel()
-                    self._timer = None
+                self._timer.cancel()
 
     def _incremental(self):
         self.osc_jog.action(self.INCREMENT * self.mul)
-        self._timer = aio.get_running_loop().call_later(self.INCREMENT_WAIT, self._incremental)
 
 
 class ArdourConnectGuard(Control):
-    TIMEOUT = 10.0
+    """
+    Keeps asking Ardour to connect until heartbeats come in. Notifies
+    'connected' whenever the connection is established or lost.
+
+    Requests are repeated with exponential backoff, starting at CONN_INTERVAL
+    and up to MAX_CONN_INTERVAL, since every /set_surface makes Ardour push
+    the whole surface state again. The link is only declared dead after
+    MISSES heartbeat intervals without a heartbeat, so a single late one does
+    not trigger a reconnect. health keeps the link's statistics.
+    """
+    __slots__ = ('surface', 'heartbeat', 'timer', 'health', '_connected', '_backoff', '_awaiting')
+
     CONN_INTERVAL = 3.0
+    MAX_CONN_INTERVAL = 30.0
+    MISSES = 3
 
-    def __init__(self, surface: osc.OSCAction, heartbeat: osc.OSCValue):
+    def __init__(self, surface: osc.OSCAction, heartbeat: osc.OSCValue, name: str = 'ardour'):
+        super().__init__()
         self.surface = surface
         self.heartbeat = heartbeat
         self.heartbeat.register(self._heartbeat_cb)
+        self.health = LinkHealth(name)
+        self.timer = Timer(self._timeout)
+        self._connected = False
+        self._backoff = self.CONN_INTERVAL
+        self._awaiting = False      # Whether we wait for the first message after a request
         self._connect()
 
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
     def _heartbeat_cb(self, _notes):
-        if self.timer is not None:
-            self.timer.cancel()
-        
-        self.timer = aio.get_running_loop().call_later(self.CONN_INTERVAL, self._connect)
+        self.health.heartbeat()
+        if not self._connected:
+            self.health.link_up()
+            self._backoff = self.CONN_INTERVAL
+        # Pushes the deadline out as long as heartbeats come in
+        self.timer.start(self.MISSES * self.health.interval)
+        with self.maybe_notify() as m:
+            self._connected = m.assign(self._connected, True, 'connected')
+
+    def _timeout(self):
+        if self._connected:
+            # Heartbeats stopped, ask again right away and back off from there
+            self.health.link_down()
+            with self.maybe_notify() as m:
+                self._connected = m.assign(self._connected, False, 'connected')
+        self._connect()
+
+    def _response(self):
+        self._awaiting = False
+        self.health.response()
 
     def _connect(self):
+        self.health.request_sent()
+        if not self._awaiting:
+            # Ardour answers /set_surface with the surface state right away
+            self._awaiting = True
+            OSCRouter.of(self.surface.osc).on_next(self._response)
         self.surface.action()
-        self.timer = aio.get_running_loop().call_later(self.CONN_INTERVAL, self._connect)
\ No newline at end of file
+        self.timer.start(self._backoff)
+        self._backoff = min(self._backoff * 2, self.MAX_CONN_INTERVAL)
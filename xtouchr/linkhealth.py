@@ -0,0 +1,95 @@
+import time
+import typing as ty
+from xtouchr.metrics import METRICS
+
+
+class LinkHealth:
+    """
+    Heartbeat statistics of the link to the DAW.
+
+    The heartbeat interval is averaged with an EWMA, jitter is the EWMA of the
+    absolute deviation from that average. The round trip time is measured from
+    the latest connection request to the first message from the DAW after it,
+    since the DAW pushes the surface state right away, see response. The
+    first sample after the link was lost is dropped, it mostly tells how long
+    the DAW took to come back.
+    """
+    __slots__ = ('name', 'interval', 'jitter', 'rtt', 'heartbeats', 'requests', 'connects', 'losses',
+                 '_last_beat', '_requested_at', '_up_since', '_skip_rtt', '__weakref__')
+
+    # Weight of a new sample in the averages
+    ALPHA = 1 / 8
+
+    def __init__(self, name: str = 'daw', interval: float = 1.0):
+        self.name = name
+        self.interval = interval        # Average time between heartbeats
+        self.jitter = 0.0
+        self.rtt: ty.Optional[float] = None
+        self.heartbeats = 0
+        self.requests = 0               # Connection requests sent
+        self.connects = 0
+        self.losses = 0
+        self._last_beat: ty.Optional[float] = None
+        self._requested_at: ty.Optional[float] = None
+        self._up_since: ty.Optional[float] = None
+        self._skip_rtt = False
+        METRICS.links.add(self)
+
+    def request_sent(self):
+        self.requests += 1
+        self._requested_at = time.monotonic()
+
+    def response(self):
+        if self._requested_at is not None:
+            if self._skip_rtt:
+                self._skip_rtt = False
+            else:
+                self.rtt = time.monotonic() - self._requested_at
+            self._requested_at = None
+
+    def heartbeat(self):
+        now = time.monotonic()
+        self.heartbeats += 1
+        if self._last_beat is not None and self._up_since is not None:
+            delta = now - self._last_beat
+            self.jitter += self.ALPHA * (abs(delta - self.interval) - self.jitter)
+            self.interval += self.ALPHA * (delta - self.interval)
+        self._last_beat = now
+
+    def link_up(self):
+        self.connects += 1
+        self._up_since = time.monotonic()
+
+    def link_down(self):
+        self.losses += 1
+        self._up_since = None
+        self._requested_at = None
+        self._skip_rtt = True
+
+    @property
+    def since_heartbeat(self) -> ty.Optional[float]:
+        return None if self._last_beat is None else time.monotonic() - self._last_beat
+
+    @property
+    def uptime(self) -> float:
+        return 0.0 if self._up_since is None else time.monotonic() - self._up_since
+
+    def snapshot(self) -> ty.Dict[str, ty.Optional[float]]:
+        return {
+            'up': float(self._up_since is not None),
+            'uptime': self.uptime,
+            'interval': self.interval,
+            'jitter': self.jitter,
+            'rtt': self.rtt,
+            'since_heartbeat': self.since_heartbeat,
+            'heartbeats': self.heartbeats,
+            'requests': self.requests,
+            'connects': self.connects,
+            'losses': self.losses,
+        }
+
+    def report(self) -> str:
+        rtt = 'n/a' if self.rtt is None else f"{self.rtt * 1e3:.1f}ms"
+        state = f"up {self.uptime:.0f}s" if self._up_since is not None else 'down'
+        return (f"link {state}, rtt {rtt}, heartbeat {self.interval * 1e3:.0f}ms +-{self.jitter * 1e3:.1f}ms, "
+                f"{self.requests} requests, {self.connects} connects, {self.losses} losses")
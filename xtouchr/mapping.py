@@ -0,0 +1,329 @@
+"""
+Declarative surface mappings. A mapping file (JSON, or TOML where tomllib is
+available) lists the controls of a surface and their DAW bindings:
+
+    {
+        "controls": [
+            {"name": "play", "type": "toggle", "note": 22, "led": 14, "path": "/transport_play"},
+            {"name": "master", "type": "main_fader", "cc": 9, "path": "/master/fader"},
+            ...
+        ]
+    }
+
+compile_mapping() validates the file and flattens the MIDI inputs and LED
+outputs into tables indexed like MidiDevice's dispatch table, (status << 7)
+| data1, and collects the OSC routes. The tables are used to reject controls
+that claim the same input or output and to inspect a layout, the controls
+still register themselves with MidiDevice and OSCRouter when they are built.
+The compiled form is pickled to a cache keyed by the file's path, size and
+mtime, so later startups skip parsing and validation. build() then creates
+the controls from the compiled form.
+"""
+import hashlib
+import json
+import os
+import pickle
+import typing as ty
+import xtouchr.midicontrols as mc
+import xtouchr.dawcontrols as dc
+import xtouchr.osccontrols as oc
+from xtouchr.mididevice import NOTE_ON, NOTE_OFF, CONTROL_CHANGE
+from xtouchr.paths import CACHE_DIR
+
+if ty.TYPE_CHECKING:
+    import aiosc
+    from xtouchr.mididevice import MidiDevice
+
+DEFAULT_MAPPING = os.path.join(os.path.dirname(__file__), 'mappings', 'xtouch_mini_ardour.json')
+# Bump whenever the compiled form changes
+FORMAT = 4
+
+
+class MappingError(ValueError):
+    pass
+
+
+class CompiledMapping(ty.NamedTuple):
+    source: str
+    # (name, type, params) with all defaults filled in, in file order
+    controls: ty.Tuple[ty.Tuple[str, str, ty.Dict[str, ty.Any]], ...]
+    # (status << 7) | data1 -> name of the control listening there
+    midi: ty.Dict[int, str]
+    # (status << 7) | data1 of LED and ring outputs -> name of the control driving it
+    leds: ty.Dict[int, str]
+    # (path, args) -> names of the controls bound to it
+    osc: ty.Dict[ty.Tuple[str, ty.Tuple], ty.Tuple[str, ...]]
+
+    def names(self, kind: str) -> ty.List[str]:
+        """
+        Returns the names of all controls of the given type
+        """
+        return [name for name, k, _ in self.controls if k == kind]
+
+
+# Per type: required fields, defaults
+SCHEMA: ty.Dict[str, ty.Tuple[ty.Tuple[str, ...], ty.Dict[str, ty.Any]]] = {
+    'toggle': (('note', 'led', 'path'), {'args': [], 'channel': 10, 'glbl_channel': 0}),
+    'loop': (('note', 'led', 'path'), {'args': [], 'channel': 10, 'glbl_channel': 0}),
+    'record': (('note', 'led'), {'channel': 10, 'glbl_channel': 0,
+                                 'rec_enable': '/rec_enable_toggle', 'tally': '/record_tally',
+                                 'play': '/transport_play'}),
+    'jog': (('note', 'path'), {'args': [], 'channel': 10, 'forward': True}),
+    'main_fader': (('cc', 'path'), {'args': [], 'channel': 10, 'rate': None}),
+    'bank': (('strips',), {'fader_ccs': [1, 2, 3, 4, 5, 6, 7, 8],
+                           'fader_buttons': [0, 1, 2, 3, 4, 5, 6, 7],
+                           'solo_notes': [8, 9, 10, 11, 12, 13, 14, 15],
+                           'solo_leds': [0, 1, 2, 3, 4, 5, 6, 7],
+                           'bank_down': [16, 8], 'bank_up': [17, 9],
+                           'feedback_rate': dc.ArdourStripFaderControl.FEEDBACK_RATE}),
+    'connect_guard': (('path',), {'args': [], 'heartbeat': '/heartbeat'}),
+}
+
+
+def _note(channel: int, note: int) -> ty.List[int]:
+    return [((NOTE_ON | channel) << 7) | note, ((NOTE_OFF | channel) << 7) | note]
+
+
+def _cc(channel: int, cc: int) -> ty.List[int]:
+    return [((CONTROL_CHANGE | channel) << 7) | cc]
+
+
+def _bindings(kind: str, p: ty.Dict) -> ty.Tuple[ty.List[int], ty.List[int], ty.List[ty.Tuple[str, ty.Tuple]]]:
+    """
+    Returns the MIDI inputs, LED/ring outputs and OSC routes of a control
+    """
+    ch, gch = p.get('channel', 10), p.get('glbl_channel', 0)
+    if kind in ('toggle', 'loop'):
+        return _note(ch, p['note']), _note(gch, p['led']), [(p['path'], tuple(p['args']))]
+    if kind == 'record':
+        return (_note(ch, p['note']), _note(gch, p['led']),
+                [(p['rec_enable'], ()), (p['tally'], ()), (p['play'], ())])
+    if kind == 'jog':
+        return _note(ch, p['note']), [], []
+    if kind == 'main_fader':
+        return _cc(ch, p['cc']), [], [(p['path'], tuple(p['args']))]
+    if kind == 'bank':
+        inputs = [_note(ch, p['bank_down'][0]), _note(ch, p['bank_up'][0])]
+        inputs += [_cc(ch, cc) for cc in p['fader_ccs']]
+        inputs += [_note(ch, n) for n in p['fader_buttons'] + p['solo_notes']]
+        leds = [_note(gch, p['bank_down'][1]), _note(gch, p['bank_up'][1])]
+        leds += [_note(gch, n) for n in p['solo_leds']]
+        # Mode and LED state CCs of the faders' rings
+        leds += [_cc(gch, cc) + _cc(gch, cc + 8) for cc in p['fader_ccs']]
+        width = len(p['fader_ccs'])
+        strips = -(-p['strips'] // width) * width     # Whole banks, as ArdourBank.build does
+        routes = [(path, (i,)) for i in range(1, strips + 1) for path in dc.ArdourStrip.PATHS]
+        routes.append(('/cancel_all_solos', ()))
+        return [i for l in inputs for i in l], [i for l in leds for i in l], routes
+    if kind == 'connect_guard':
+        return [], [], [(p['heartbeat'], ())]
+    return [], [], []
+
+
+def _int(where: str, key: str, val: ty.Any, limit: int):
+    # bool is an int too, but never meant as one here
+    if not isinstance(val, int) or isinstance(val, bool) or not 0 <= val < limit:
+        raise MappingError(f"{where}: {key} must be 0..{limit - 1}, got {val!r}")
+
+
+def _number(where: str, key: str, val: ty.Any):
+    _int(where, key, val, 128)
+
+
+def _channel(where: str, key: str, val: ty.Any):
+    _int(where, key, val, 16)
+
+
+def _ring_cc(where: str, key: str, val: ty.Any):
+    # The ring's LED state is set through the CC 8 above its mode CC
+    _int(where, key, val, 120)
+
+
+def _list_of(check: ty.Callable, length: ty.Optional[int] = None) -> ty.Callable:
+    def check_list(where: str, key: str, val: ty.Any):
+        if not isinstance(val, list) or (length is not None and len(val) != length):
+            what = f"a list of {length}" if length is not None else 'a list'
+            raise MappingError(f"{where}: {key} must be {what}, got {val!r}")
+        for i, item in enumerate(val):
+            check(where, f"{key}[{i}]", item)
+    return check_list
+
+
+def _string(where: str, key: str, val: ty.Any):
+    if not isinstance(val, str) or not val:
+        raise MappingError(f"{where}: {key} must be a non-empty string, got {val!r}")
+
+
+def _osc_args(where: str, key: str, val: ty.Any):
+    if not isinstance(val, list) or not all(isinstance(arg, (int, float, str)) for arg in val):
+        raise MappingError(f"{where}: {key} must be a list of numbers and strings, got {val!r}")
+
+
+def _flag(where: str, key: str, val: ty.Any):
+    if not isinstance(val, bool):
+        raise MappingError(f"{where}: {key} must be true or false, got {val!r}")
+
+
+def _rate(where: str, key: str, val: ty.Any):
+    if val is not None and (isinstance(val, bool) or not isinstance(val, (int, float)) or val <= 0):
+        raise MappingError(f"{where}: {key} must be a positive number or null, got {val!r}")
+
+
+def _positive(where: str, key: str, val: ty.Any):
+    if not isinstance(val, int) or isinstance(val, bool) or val < 1:
+        raise MappingError(f"{where}: {key} must be a positive integer, got {val!r}")
+
+
+# How every field is checked
+FIELDS: ty.Dict[str, ty.Callable[[str, str, ty.Any], None]] = {
+    'note': _number, 'led': _number, 'cc': _number,
+    'channel': _channel, 'glbl_channel': _channel,
+    'fader_ccs': _list_of(_ring_cc), 'fader_buttons': _list_of(_number),
+    'solo_notes': _list_of(_number), 'solo_leds': _list_of(_number),
+    'bank_down': _list_of(_number, 2), 'bank_up': _list_of(_number, 2),
+    'path': _string, 'heartbeat': _string, 'rec_enable': _string, 'tally': _string, 'play': _string,
+    'args': _osc_args, 'forward': _flag, 'rate': _rate, 'feedback_rate': _rate, 'strips': _positive,
+}
+
+
+def _validate(index: int, entry: ty.Any) -> ty.Tuple[str, str, ty.Dict[str, ty.Any]]:
+    if not isinstance(entry, dict):
+        raise MappingError(f"control #{index}: expected an object, got {entry!r}")
+    kind = entry.get('type')
+    if kind not in SCHEMA:
+        raise MappingError(f"control #{index}: unknown type {kind!r}, expected one of {sorted(SCHEMA)}")
+    required, defaults = SCHEMA[kind]
+    missing = [key for key in required if key not in entry]
+    if missing:
+        raise MappingError(f"control #{index} ({kind}): missing {', '.join(missing)}")
+    unknown = set(entry) - set(required) - set(defaults) - {'type', 'name'}
+    if unknown:
+        raise MappingError(f"control #{index} ({kind}): unknown fields {', '.join(sorted(unknown))}")
+    params = dict(defaults)
+    params.update((key, val) for key, val in entry.items() if key not in ('type', 'name'))
+    where = f"control #{index} ({kind})"
+    for key, val in params.items():
+        check = FIELDS.get(key)
+        if check is not None:
+            check(where, key, val)
+    if kind == 'bank':
+        width = len(params['fader_ccs'])
+        if width == 0 or any(len(params[key]) != width for key in ('fader_buttons', 'solo_notes', 'solo_leds')):
+            raise MappingError(f"{where}: fader and solo lists must have the same, non-zero length")
+    name = entry.get('name', f"{kind}{index}")
+    _string(where, 'name', name)
+    return name, kind, params
+
+
+def _load(path: str) -> ty.Dict[str, ty.Any]:
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compile_mapping(path: str) -> CompiledMapping:
+    """
+    Parses and validates a mapping file, raises MappingError if it is invalid
+    or two controls claim the same MIDI input or LED
+    """
+    try:
+        data = _load(path)
+    except ValueError as e:
+        raise MappingError(f"{path}: {e}") from e
+    entries = data.get('controls') if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        raise MappingError(f"{path}: expected a top level 'controls' list")
+    controls = []
+    midi: ty.Dict[int, str] = {}
+    leds: ty.Dict[int, str] = {}
+    osc: ty.Dict[ty.Tuple[str, ty.Tuple], ty.List[str]] = {}
+    for index, entry in enumerate(entries):
+        name, kind, params = _validate(index, entry)
+        if any(name == other for other, _, _ in controls):
+            raise MappingError(f"{path}: duplicate control name {name!r}")
+        inputs, outputs, routes = _bindings(kind, params)
+        for table, keys, what in ((midi, inputs, 'MIDI input'), (leds, outputs, 'LED')):
+            for key in keys:
+                owner = table.get(key)
+                if owner == name:
+                    raise MappingError(f"{path}: {name!r} uses {what} "
+                                       f"status 0x{key >> 7:02x}, data 0x{key & 0x7f:02x} twice")
+                if owner is not None:
+                    raise MappingError(f"{path}: {name!r} and {owner!r} share {what} "
+                                       f"status 0x{key >> 7:02x}, data 0x{key & 0x7f:02x}")
+                table[key] = name
+        for route in routes:
+            osc.setdefault(route, []).append(name)
+        controls.append((name, kind, params))
+    return CompiledMapping(path, tuple(controls), midi, leds,
+                           {route: tuple(names) for route, names in osc.items()})
+
+
+def _cache_path(path: str) -> ty.Tuple[str, str]:
+    st = os.stat(path)
+    key = f"{FORMAT}:{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+    return os.path.join(CACHE_DIR, hashlib.sha1(key.encode()).hexdigest() + '.pickle'), key
+
+
+def load_mapping(path: str = DEFAULT_MAPPING, cache: bool = True) -> CompiledMapping:
+    """
+    Returns the compiled mapping, from the cache if the file did not change
+    """
+    if not cache:
+        return compile_mapping(path)
+    cache_file, key = _cache_path(path)
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_key, compiled = pickle.load(f)
+        if cached_key == key:
+            return compiled
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        pass
+    compiled = compile_mapping(path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{cache_file}.{os.getpid()}"
+        with open(tmp, 'wb') as f:
+            pickle.dump((key, compiled), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        print(f"Could not cache compiled mapping: {e}")
+    return compiled
+
+
+def _build_control(name: str, kind: str, p: ty.Dict[str, ty.Any], dev: "MidiDevice", proto: "aiosc.OSCProtocol"):
+    if kind == 'toggle':
+        return dc.DAWToggleSetOnly(mc.LEDButton(dev, p['note'], p['led'], p['channel'], p['glbl_channel']),
+                                   oc.OSCToggleSetOnly(proto, p['path'], *p['args']))
+    if kind == 'loop':
+        return dc.ArdourLoopToggle(mc.LEDButton(dev, p['note'], p['led'], p['channel'], p['glbl_channel']),
+                                   oc.OSCToggle(proto, p['path'], *p['args']))
+    if kind == 'record':
+        return dc.ArdourRecordButton(mc.LEDButton(dev, p['note'], p['led'], p['channel'], p['glbl_channel']),
+                                     oc.OSCToggle(proto, p['rec_enable']),
+                                     oc.OSCValue(proto, p['tally']),
+                                     oc.OSCValue(proto, p['play']))
+    if kind == 'jog':
+        return dc.ArdourJogControl(mc.Button(dev, p['note'], p['channel']),
+                                   oc.OSCAction(proto, p['path'], *p['args']), p['forward'])
+    if kind == 'main_fader':
+        return dc.DAWMainFader(mc.Fader(dev, p['cc'], p['channel']),
+                               oc.OSCFader(proto, p['path'], *p['args'], rate=p['rate']))
+    if kind == 'bank':
+        return dc.ArdourBank.build(dev, proto, p['strips'], p['fader_ccs'], p['fader_buttons'],
+                                   p['solo_notes'], p['solo_leds'], tuple(p['bank_down']), tuple(p['bank_up']),
+                                   p['feedback_rate'])
+    if kind == 'connect_guard':
+        return dc.ArdourConnectGuard(oc.OSCAction(proto, p['path'], *p['args']), oc.OSCValue(proto, p['heartbeat']),
+                                     name)
+    raise MappingError(f"unknown control type {kind!r}")
+
+
+def build(compiled: CompiledMapping, dev: "MidiDevice", proto: "aiosc.OSCProtocol") -> ty.Dict[str, ty.Any]:
+    """
+    Creates all controls of a compiled mapping, keyed by name
+    """
+    return {name: _build_control(name, kind, params, dev, proto) for name, kind, params in compiled.controls}
@@ -0,0 +1,140 @@
+import asyncio as aio
+import typing as ty
+import weakref
+from xtouchr.timers import TIMERS
+
+KINDS = {0x80: 'note_off', 0x90: 'note_on', 0xB0: 'cc'}
+
+
+class Metrics:
+    """
+    Runtime counters and gauges in the Prometheus text exposition format.
+
+    Counting is opt-in: the hot paths only count messages and notify calls
+    after enable(), keyed by (status << 7) | data1 for MIDI, by path for OSC
+    and by class for controls. Use rate() on them for messages per second.
+    Queues, devices, reply filters and links add themselves to the weak sets
+    below when they are created, their state is read when metrics are served.
+    Queues and devices are labeled by their MIDI port's name, links by theirs,
+    so a series keeps referring to the same instance between scrapes.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.midi_in: ty.Dict[int, int] = {}
+        self.midi_out: ty.Dict[int, int] = {}
+        self.osc_in: ty.Dict[str, int] = {}
+        self.osc_out: ty.Dict[str, int] = {}
+        self.notify: ty.Dict[type, int] = {}
+        self.queues = weakref.WeakSet()
+        self.devices = weakref.WeakSet()
+        self.filters = weakref.WeakSet()
+        self.links = weakref.WeakSet()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    @staticmethod
+    def count(counts: ty.Dict[ty.Hashable, int], key: ty.Hashable):
+        counts[key] = counts.get(key, 0) + 1
+
+    def reset(self):
+        for counts in (self.midi_in, self.midi_out, self.osc_in, self.osc_out, self.notify):
+            counts.clear()
+
+    @staticmethod
+    def _midi_labels(key: int) -> ty.Dict[str, ty.Any]:
+        status = key >> 7
+        return {'kind': KINDS.get(status & 0xF0, f"0x{status & 0xF0:02x}"),
+                'channel': status & 0x0F, 'number': key & 0x7F}
+
+    def samples(self) -> ty.Iterator[ty.Tuple[str, str, str, ty.List[ty.Tuple[ty.Dict[str, ty.Any], float]]]]:
+        """
+        Yields (name, type, help, [(labels, value)]) for every metric
+        """
+        yield ('xtouchr_midi_in_total', 'counter', 'MIDI messages dispatched per address',
+               [(self._midi_labels(key), n) for key, n in sorted(self.midi_in.items())])
+        yield ('xtouchr_midi_out_total', 'counter', 'MIDI messages sent per address',
+               [(self._midi_labels(key), n) for key, n in sorted(self.midi_out.items())])
+        yield ('xtouchr_osc_in_total', 'counter', 'OSC messages received per path',
+               [({'path': path}, n) for path, n in sorted(self.osc_in.items())])
+        yield ('xtouchr_osc_out_total', 'counter', 'OSC messages sent per path',
+               [({'path': path}, n) for path, n in sorted(self.osc_out.items())])
+        yield ('xtouchr_notify_total', 'counter', 'Change notifications per control class',
+               sorted((({'control': cls.__qualname__}, n) for cls, n in self.notify.items()),
+                      key=lambda sample: sample[0]['control']))
+        queues = sorted(self.queues, key=lambda q: q.name)
+        yield ('xtouchr_midi_queue_depth', 'gauge', 'Messages waiting in the MIDI input queue',
+               [({'queue': q.name}, q.depth) for q in queues])
+        yield ('xtouchr_midi_queue_dropped_total', 'counter', 'MIDI input messages dropped on overflow',
+               [({'queue': q.name}, q.dropped) for q in queues])
+        yield ('xtouchr_midi_queue_coalesced_total', 'counter', 'MIDI input CCs coalesced on overflow',
+               [({'queue': q.name}, q.coalesced) for q in queues])
+        yield ('xtouchr_midi_suppressed_total', 'counter', 'MIDI sends dropped since the device already shows them',
+               [({'device': d.midi_out.name}, d.suppressed)
+                for d in sorted(self.devices, key=lambda d: d.midi_out.name)])
+        filters = list(self.filters)
+        yield ('xtouchr_reply_filter_total', 'counter', 'Sent OSC values by what happened to their echo',
+               [({'result': 'hit'}, sum(f.hits for f in filters)),
+                ({'result': 'miss'}, sum(f.misses for f in filters)),
+                ({'result': 'expired'}, sum(f.expired for f in filters))])
+        yield ('xtouchr_timers_active', 'gauge', 'Timers currently running', [({}, TIMERS.active)])
+        links = [(link.name, link.snapshot()) for link in sorted(self.links, key=lambda link: link.name)]
+        for field, kind, help_text in (('up', 'gauge', 'Whether the DAW link is up'),
+                                       ('rtt', 'gauge', 'Seconds from the last connection request to the first message after it'),
+                                       ('interval', 'gauge', 'Average seconds between heartbeats'),
+                                       ('jitter', 'gauge', 'Average deviation of the heartbeat interval in seconds'),
+                                       ('heartbeats', 'counter', 'Heartbeats received'),
+                                       ('requests', 'counter', 'Connection requests sent'),
+                                       ('losses', 'counter', 'Times the link was declared dead')):
+            name = f"xtouchr_link_{field}_total" if kind == 'counter' else f"xtouchr_link_{field}"
+            yield (name, kind, help_text,
+                   [({'link': link_name}, snapshot[field]) for link_name, snapshot in links if snapshot[field] is not None])
+
+    def render(self) -> str:
+        lines = []
+        for name, kind, help_text, samples in self.samples():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if labels:
+                    label_str = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{label_str}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, port: ty.Optional[int] = None, path: ty.Optional[str] = None,
+                    host: str = '127.0.0.1') -> aio.AbstractServer:
+        """
+        Serves the metrics over HTTP on host:port or on the Unix socket at path
+        """
+        if path is not None:
+            return await aio.start_unix_server(self._handle, path)
+        return await aio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader: aio.StreamReader, writer: aio.StreamWriter):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if request.split()[:1] == [b'GET']:
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '405 Method Not Allowed', b''
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _escape(value: ty.Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+METRICS = Metrics()
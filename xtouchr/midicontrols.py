@@ -5,9 +5,13 @@ import abc
 from enum import Enum
 import mido
 from xtouchr.controls import Control
+from xtouchr.mididevice import NOTE_ON, CONTROL_CHANGE
+from xtouchr.timers import Throttle
 
 
 class LEDButton(Control):
+    __slots__ = ('device', 'note', 'glbl_note', 'channel', 'glbl_channel', '_led', '_pressed')
+
     class LED(Enum):
         OFF = 0
         ON = 1
@@ -23,13 +27,14 @@ class LEDButton(Control):
         self.device.register_note_callback(self.channel, self.note, self.midi_callback)
         self._led = self.LED.OFF     # Tracks LED state
         self._pressed = False        # Tracks button state
+        self.device.register_output(self.update_midi_device)
         self.update_midi_device()
 
-    async def midi_callback(self, pressed: bool, velocity: int):
+    def midi_callback(self, pressed: bool, velocity: int):
+        # Device will always turn LED on when button is pressed and off when not
+        self.device.forget(NOTE_ON, self.glbl_channel, self.glbl_note)
         with self.maybe_notify() as m:
             self._pressed = m.assign(self._pressed, pressed, 'pressed')
-
-            # Device will always turn LED on when button is pressed and off when not
             new_led = self.LED.ON if pressed else self.LED.OFF
             self._led = m.assign(self._led, new_led, 'led')
 
@@ -54,6 +59,15 @@ class LEDButton(Control):
         self.device.send(mido.Message('note_on', channel=self.glbl_channel, note=self.glbl_note, velocity=self._led.value))
 
 class LEDFader(Control):
+    """
+    Endless knob with an LED ring. Values coming back from the DAW should be
+    set through feedback, which updates the ring at most feedback_rate times
+    per second and always shows the latest value in the end. Setting value
+    directly or turning the knob is never delayed and drops pending feedback.
+    """
+    __slots__ = ('device', 'cc', 'glbl_cc', 'channel', 'glbl_channel', '_mode', '_led', '_value',
+                 '_feedback_pending', '_feedback_throttle')
+
     class Mode(Enum):
         PAN = 1
         FAN = 2
@@ -66,7 +80,8 @@ class LEDFader(Control):
         BLINKING = 28   # All fader LEDs are blinking
         FADER = 255     # Indicating that the fader position is shown
 
-    def __init__(self, device: "MidiDevice", cc: int, glbl_cc: int, channel: int = 10, glbl_channel: int = 0):
+    def __init__(self, device: "MidiDevice", cc: int, glbl_cc: int, channel: int = 10, glbl_channel: int = 0,
+                 feedback_rate: ty.Optional[float] = None):
         super().__init__()
         self.device = device
         self.cc = cc
@@ -77,23 +92,54 @@ class LEDFader(Control):
         self._mode = None
         self._led = None
         self._value = None
+        self._feedback_pending: ty.Optional[int] = None
+        self._feedback_throttle = Throttle(self._deliver_feedback, feedback_rate)
         self.mode = self.Mode.PAN
         self.led = self.LED.FADER
         self.value = 0
+        self.device.register_output(self.update_midi_device)
 
-    async def midi_callback(self, value: int):
+    def midi_callback(self, value: int):
+        # Moving any knob will turn global LED state off and show the fader value
+        self._cancel_feedback()
+        self._forget_led()
+        self.device.forget(CONTROL_CHANGE, self.channel, self.cc)
         with self.maybe_notify() as m:
             self._value = m.assign(self._value, value, 'value')
-
-            # Moving any knob will turn global LED state off and show the fader value
             self._led = m.assign(self._led, self.LED.FADER, 'led')
 
+    def _forget_display(self):
+        # Mode and LED state both decide what the ring shows, setting one overrides the other
+        self.device.forget(CONTROL_CHANGE, self.glbl_channel, self.glbl_cc)
+        self.device.forget(CONTROL_CHANGE, self.glbl_channel, self.glbl_cc+8)
+
+    def _forget_led(self):
+        # A value shows the fader position and ends the LED state, the mode stays
+        self.device.forget(CONTROL_CHANGE, self.glbl_channel, self.glbl_cc+8)
+
+    def feedback(self, val: int):
+        """
+        Shows a value coming from the DAW, rate limited to feedback_rate
+        """
+        self._feedback_pending = val
+        self._feedback_throttle.request()
+
+    def _deliver_feedback(self):
+        val = self._feedback_pending
+        if val is not None:
+            self.value = val
+
+    def _cancel_feedback(self):
+        self._feedback_pending = None
+        self._feedback_throttle.cancel()
+
     @property
     def value(self) -> int:
         return self._value
     
     @value.setter
     def value(self, val: int):
+        self._cancel_feedback()
         val = int(val)
         if (val < 0) or (val > 127):
             print(f"New fader value {val} not in range [0, 127], ignoring")
@@ -103,6 +149,7 @@ class LEDFader(Control):
             with self.maybe_notify() as m:
                 self._value = val
                 self._led = m.assign(self._led, self.LED.FADER, 'led')
+                self._forget_led()
                 self.device.send(mido.Message('control_change', channel=self.channel, control=self.cc, value=self._value))
 
     @property
@@ -116,6 +163,7 @@ class LEDFader(Control):
             with self.maybe_notify() as m:
                 self._mode = m.assign(self._mode, val, 'mode')
                 self._led = m.assign(self._led, self.LED.FADER, 'led')
+                self._forget_display()
                 self.device.send(mido.Message('control_change', channel=self.glbl_channel, control=self.glbl_cc, value=self._mode.value))
 
     @property
@@ -130,12 +178,28 @@ class LEDFader(Control):
                 self._led = m.assign(self._led, val, 'led')
             if self._led == self.LED.FADER:
                 # Set fader mode to return showing the fader value
+                self._forget_display()
                 self.device.send(mido.Message('control_change', channel=self.glbl_channel, control=self.glbl_cc, value=self._mode.value))
             else:
+                # The device keeps its mode, so the shadow of the mode stays valid
                 self.device.send(mido.Message('control_change', channel=self.glbl_channel, control=self.glbl_cc+8, value=self._led.value))
 
+    def update_midi_device(self):
+        """
+        Sends the complete state of the fader, the device drops what it already shows
+        """
+        if self.device.send(mido.Message('control_change', channel=self.channel, control=self.cc, value=self._value)):
+            self._forget_led()
+        if self.device.send(mido.Message('control_change', channel=self.glbl_channel, control=self.glbl_cc, value=self._mode.value)):
+            # Mode returns to showing the fader value
+            self._forget_led()
+        if self._led != self.LED.FADER:
+            self.device.send(mido.Message('control_change', channel=self.glbl_channel, control=self.glbl_cc+8, value=self._led.value))
+
 
 class Button(Control):
+    __slots__ = ('device', 'note', 'channel', '_pressed')
+
     def __init__(self, device: "MidiDevice", note: int, channel: int = 10):
         super().__init__()
         self.device = device
@@ -144,7 +208,7 @@ class Button(Control):
         self.device.register_note_callback(self.channel, self.note, self.midi_callback)
         self._pressed = False        # Tracks button state
 
-    async def midi_callback(self, pressed: bool, velocity: int):
+    def midi_callback(self, pressed: bool, velocity: int):
         with self.maybe_notify() as m:
             self._pressed = m.assign(self._pressed, pressed, 'pressed')
 
@@ -153,6 +217,8 @@ class Button(Control):
         return self.pressed
 
 class Fader(Control):
+    __slots__ = ('device', 'cc', 'channel', '_value')
+
     def __init__(self, device: "MidiDevice", cc: int, channel: int = 10):
         super().__init__()
         self.device = device
@@ -161,7 +227,7 @@ class Fader(Control):
         self.device.register_cc_callback(self.channel, self.cc, self.midi_callback)
         self._value = 0
 
-    async def midi_callback(self, value: int):
+    def midi_callback(self, value: int):
         with self.maybe_notify() as m:
             self._value = m.assign(self._value, value, 'value')
 
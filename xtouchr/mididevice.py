@@ -1,57 +1,353 @@
 import mido
 import asyncio as aio
 from xtouchr.aiomidiqueue import AioMidiQueue
+from xtouchr.midischeduler import MidiOutScheduler
+from xtouchr.tracing import TRACER
+from xtouchr.recorder import RECORDER
+from xtouchr.metrics import METRICS
 import typing as ty
 
+if ty.TYPE_CHECKING:
+    from xtouchr.runtime import MidiIOThread
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+CONTROL_CHANGE = 0xB0
+
 class MidiDevice:
     """
     This class manages a MIDI control device, such as the X-Touch mini. It is
     responsible for creating the MIDI in and out ports, dispatching received MIDI
     messages to the correct MidiControl and offer a way to send back messages to
     the device from MidiControls
+
+    With batch enabled, everything that queued up since the last dispatch is
+    drained at once and only the latest value of each CC is dispatched, while
+    note events are kept in order.
+
+    Callbacks are called directly. Only callbacks that return a coroutine get
+    a task scheduled, and at most MAX_PENDING_TASKS of those are kept alive.
+
+    In raw mode, the input port delivers the plain status/data bytes and
+    routing is a single lookup in a flat table indexed by status byte and
+    data1, without creating any mido.Message objects.
+
+    With a frame_rate, outgoing messages go through a MidiOutScheduler that
+    only writes the latest value per address once per frame.
+
+    The device keeps a shadow of the last value sent to every note and CC
+    address and drops sends that would not change anything on the device.
+    Controls call forget when the device changed an address by itself.
+    Controls with outputs register a function that sends their whole state,
+    resync uses these to bring the device in line with the controls.
+
+    With an io thread, messages that pass the shadow are handed over to the
+    MidiIOThread, which writes them to the port and runs the scheduler, so
+    output never waits behind the control logic on the main loop. Messages
+    are collected until the callbacks that are ready in the current main loop
+    iteration have run and then handed over at once.
     """
+    MAX_PENDING_TASKS = 64
 
-    def __init__(self, midi_in: mido.ports.BaseInput, midi_out: mido.ports.BaseOutput):
+    def __init__(self, midi_in: mido.ports.BaseInput, midi_out: mido.ports.BaseOutput, batch: bool = False, raw: bool = False,
+                 frame_rate: ty.Optional[float] = None,
+                 overflow: AioMidiQueue.Overflow = AioMidiQueue.Overflow.COALESCE_CC,
+                 io: ty.Optional["MidiIOThread"] = None):
+        self.batch = batch
+        self.raw = raw
         self.midi_in = midi_in
         self.midi_out = midi_out
-        self.queue_in = AioMidiQueue(self.midi_in)
+        self.scheduler = MidiOutScheduler(self._write_port, frame_rate) if frame_rate else None
+        self.queue_in = AioMidiQueue(self.midi_in, raw=raw, overflow=overflow)
         self.note_callbacks = {}
         self.cc_callbacks = {}
+        # Callback lists indexed by (status << 7) | data1, shared with the dicts above
+        self._table: ty.List[ty.Optional[ty.List[ty.Callable]]] = [None] * (256 << 7)
+        self._tasks = set()
+        self._shadow: ty.Dict[ty.Tuple[int, int, int], mido.Message] = {}
+        self._outputs: ty.List[ty.Callable[[], None]] = []
+        self.suppressed = 0     # Sends dropped since they would not change anything
+        self.io = io
+        self._outbox: ty.List[mido.Message] = []
+        self._handoff = False   # Whether a hand over of the outbox is scheduled on the main loop
+        METRICS.devices.add(self)
 
-    def register_note_callback(self, channel: int, note: int, callback: ty.Coroutine):
+    def register_output(self, update: ty.Callable[[], None]):
+        self._outputs.append(update)
+
+    def register_note_callback(self, channel: int, note: int, callback: ty.Callable):
         key = (channel, note)
         if key not in self.note_callbacks:
             self.note_callbacks[key] = [callback]
+            self._table[((NOTE_ON | channel) << 7) | note] = self.note_callbacks[key]
+            self._table[((NOTE_OFF | channel) << 7) | note] = self.note_callbacks[key]
         else:
             self.note_callbacks[key].append(callback)
 
-    def register_cc_callback(self, channel: int, cc: int, callback: ty.Coroutine):
+    def register_cc_callback(self, channel: int, cc: int, callback: ty.Callable):
         key = (channel, cc)
         if key not in self.cc_callbacks:
             self.cc_callbacks[key] = [callback]
+            self._table[((CONTROL_CHANGE | channel) << 7) | cc] = self.cc_callbacks[key]
         else:
             self.cc_callbacks[key].append(callback)
 
     async def start(self):
+        deploy = self._deploy_raw if self.raw else self._deploy
+        traced = self.queue_in.traced
+        if self.batch:
+            coalesce = self._coalesce_raw if self.raw else self._coalesce
+            while True:
+                batch = await self.queue_in.get_batch()
+                frame = coalesce(batch)
+                if traced:
+                    self._deploy_traced(deploy, batch, frame, self.queue_in.last_stamps)
+                    continue
+                for msg in frame:
+                    deploy(msg)
+
         while True:
             async for msg in self.queue_in:
-                if msg.type in ('note_on', 'note_off'):
-                    self._deploy_note(msg)
-                elif msg.type == 'control_change':
-                    self._deploy_cc(msg)
+                if traced:
+                    self._deploy_traced(deploy, (msg,), (msg,), self.queue_in.last_stamps)
+                    continue
+                deploy(msg)
+
+    @staticmethod
+    def _deploy_traced(deploy: ty.Callable, batch: ty.Sequence, frame: ty.Sequence, stamps: ty.Sequence[float]):
+        # Every message in the batch has its stamp, even the coalesced ones
+        arrivals = {id(msg): t for msg, t in zip(batch, stamps)}
+        for msg in frame:
+            TRACER.begin('midi', arrivals[id(msg)])
+            # Time from arrival to dispatch, one sample per dispatched message
+            TRACER.mark('dispatch')
+            try:
+                deploy(msg)
+            finally:
+                TRACER.end()
+
+    @staticmethod
+    def _coalesce(batch: ty.List[mido.Message]) -> ty.List[mido.Message]:
+        """
+        Drops every CC message that is overwritten by a later one for the same
+        (channel, cc) within the batch. All other messages keep their order.
+        """
+        if len(batch) < 2:
+            return batch
+
+        seen = set()
+        frame = []
+        for msg in reversed(batch):
+            if msg.type == 'control_change':
+                key = (msg.channel, msg.control)
+                if key in seen:
+                    continue
+                seen.add(key)
+            frame.append(msg)
+        frame.reverse()
+        return frame
+
+    @staticmethod
+    def _coalesce_raw(batch: ty.List[ty.Sequence[int]]) -> ty.List[ty.Sequence[int]]:
+        """
+        Same as _coalesce, but for raw byte messages
+        """
+        if len(batch) < 2:
+            return batch
+
+        seen = set()
+        frame = []
+        for data in reversed(batch):
+            if len(data) == 3 and (data[0] & 0xF0) == CONTROL_CHANGE:
+                key = (data[0] << 7) | data[1]
+                if key in seen:
+                    continue
+                seen.add(key)
+            frame.append(data)
+        frame.reverse()
+        return frame
+
+    def _deploy_raw(self, data: ty.Sequence[int]):
+        if len(data) != 3:
+            return
+
+        status, data1, data2 = data
+        if METRICS.enabled:
+            METRICS.count(METRICS.midi_in, (status << 7) | data1)
+        cbs = self._table[(status << 7) | data1]
+        if cbs is None:
+            return
+
+        kind = status & 0xF0
+        if kind == CONTROL_CHANGE:
+            for cb in cbs:
+                res = cb(data2)
+                if res is not None:
+                    self._schedule(res)
+        else:
+            on = (kind == NOTE_ON)
+            for cb in cbs:
+                res = cb(on, data2)
+                if res is not None:
+                    self._schedule(res)
+
+    def _deploy(self, msg: mido.Message):
+        if msg.type in ('note_on', 'note_off'):
+            self._deploy_note(msg)
+        elif msg.type == 'control_change':
+            self._deploy_cc(msg)
 
     def _deploy_note(self, msg: mido.Message):
         key = (msg.channel, msg.note)
         on = (msg.type == 'note_on')
+        if METRICS.enabled:
+            METRICS.count(METRICS.midi_in, (((NOTE_ON if on else NOTE_OFF) | msg.channel) << 7) | msg.note)
         if key in self.note_callbacks:
             for cb in self.note_callbacks[key]:
-                aio.get_event_loop().create_task(cb(on, msg.velocity))
+                res = cb(on, msg.velocity)
+                if res is not None:
+                    self._schedule(res)
 
     def _deploy_cc(self, msg: mido.Message):
         key = (msg.channel, msg.control)
+        if METRICS.enabled:
+            METRICS.count(METRICS.midi_in, ((CONTROL_CHANGE | msg.channel) << 7) | msg.control)
         if key in self.cc_callbacks:
             for cb in self.cc_callbacks[key]:
-                aio.get_event_loop().create_task(cb(msg.value))
+                res = cb(msg.value)
+                if res is not None:
+                    self._schedule(res)
+
+    def _schedule(self, res: ty.Any):
+        if not aio.iscoroutine(res):
+            return
+
+        if len(self._tasks) >= self.MAX_PENDING_TASKS:
+            print(f"Too many pending MIDI callbacks, dropping {res!r}")
+            res.close()
+            return
+
+        task = aio.get_running_loop().create_task(res)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _address(msg: mido.Message) -> ty.Optional[ty.Tuple[int, int, int]]:
+        if msg.type == 'control_change':
+            return (CONTROL_CHANGE, msg.channel, msg.control)
+        elif msg.type in ('note_on', 'note_off'):
+            return (NOTE_ON, msg.channel, msg.note)
+        return None
+
+    @staticmethod
+    def _same(a: mido.Message, b: mido.Message) -> bool:
+        if a.type != b.type:
+            return False
+        elif a.type == 'control_change':
+            return a.value == b.value
+        return a.velocity == b.velocity
+
+    def send(self, msg: mido.Message) -> bool:
+        """
+        Sends the message unless it would not change anything on the device.
+        Returns whether it was sent.
+        """
+        address = self._address(msg)
+        if address is not None:
+            last = self._shadow.get(address)
+            if last is not None and self._same(last, msg):
+                self.suppressed += 1
+                return False
+            self._shadow[address] = msg
+        self._write(msg)
+        return True
+
+    def forget(self, kind: int, channel: int, number: int):
+        """
+        Marks an address (kind is NOTE_ON or CONTROL_CHANGE) as unknown, so
+        the next send to it goes out in any case
+        """
+        self._shadow.pop((kind, channel, number), None)
+
+    def resync(self, unknown: bool = False):
+        """
+        Rebuilds the surface from the state of all controls and sends what
+        differs from what the device is known to show, in one burst. If the
+        device's state is unknown, e.g. after it was re-plugged, everything
+        is sent.
+        """
+        if unknown:
+            self._shadow.clear()
+        for update in self._outputs:
+            update()
+        self.flush()
+
+    def reconnect(self, midi_in: mido.ports.BaseInput, midi_out: mido.ports.BaseOutput):
+        """
+        Switches over to new ports of the (re-plugged) device and restores the
+        surface. The old output port is closed here, on the io thread if there
+        is one, since that is where it is written to.
+        """
+        self.midi_in = midi_in
+        self.queue_in.attach(midi_in)
+        if self.io is not None:
+            self.io.call(self._swap_out, midi_out)
+        else:
+            self._swap_out(midi_out)
+        self.resync(unknown=True)
+
+    def _swap_out(self, midi_out: mido.ports.BaseOutput):
+        old, self.midi_out = self.midi_out, midi_out
+        try:
+            old.close()
+        except (IOError, OSError):
+            pass
+
+    def _write(self, msg: mido.Message):
+        if TRACER.enabled:
+            TRACER.mark('midi')
+        if RECORDER.active:
+            RECORDER.midi_out(msg)
+        if METRICS.enabled:
+            data = msg.bytes()
+            if len(data) > 1:
+                METRICS.count(METRICS.midi_out, (data[0] << 7) | data[1])
+        if self.io is not None:
+            self._outbox.append(msg)
+            if not self._handoff:
+                # Handed over after everything else ready in this iteration ran
+                self._handoff = True
+                aio.get_running_loop().call_soon(self._hand_over)
+        else:
+            self._emit(msg)
+
+    def _emit(self, msg: mido.Message):
+        if self.scheduler is not None:
+            self.scheduler.send(msg)
+        else:
+            self.midi_out.send(msg)
+
+    def _hand_over(self):
+        # Runs on the main loop, the io thread only ever sees the handed over list
+        self._handoff = False
+        outbox, self._outbox = self._outbox, []
+        if outbox:
+            self.io.call(self._emit_all, outbox)
+
+    def _emit_all(self, msgs: ty.List[mido.Message]):
+        for msg in msgs:
+            self._emit(msg)
+
+    def _write_port(self, msg: mido.Message):
+        self.midi_out.send(msg)
 
-    def send(self, msg: mido.Message):
-        self.midi_out.send(msg)
\ No newline at end of file
+    def flush(self):
+        """
+        Writes out all buffered messages immediately
+        """
+        if self.io is not None:
+            self._hand_over()
+            if self.scheduler is not None:
+                self.io.call(self.scheduler.flush)
+        elif self.scheduler is not None:
+            self.scheduler.flush()
@@ -0,0 +1,63 @@
+import time
+import typing as ty
+import mido
+from xtouchr.timers import Timer
+
+
+class MidiOutScheduler:
+    """
+    Buffers outgoing MIDI messages per (type, channel, control/note) and writes
+    only the latest message for every address, at most once per frame.
+    Messages go out in the order of their latest write.
+
+    If nothing was written during the last frame, a message is written right
+    away, so single events don't pay any extra latency. Only messages that
+    follow within the same frame are buffered until the frame is over.
+    """
+
+    def __init__(self, write: ty.Callable[[mido.Message], None], frame_rate: float = 60.0):
+        self._write = write
+        self._interval = 1.0 / frame_rate
+        self._pending: ty.Dict[ty.Hashable, mido.Message] = {}
+        self._last_flush = float('-inf')
+        self._timer = Timer(self.flush)
+        self._seq = 0
+
+    def _key(self, msg: mido.Message) -> ty.Hashable:
+        if msg.type == 'control_change':
+            return (msg.type, msg.channel, msg.control)
+        elif msg.type in ('note_on', 'note_off'):
+            # Note on and off address the same LED
+            return ('note', msg.channel, msg.note)
+
+        # Everything else is not coalesced and sent in order
+        self._seq += 1
+        return (msg.type, self._seq)
+
+    def send(self, msg: mido.Message):
+        now = time.monotonic()
+        if not self._timer.active and now - self._last_flush >= self._interval:
+            # Idle, no reason to wait
+            self._last_flush = now
+            self._write(msg)
+            return
+
+        # The latest write goes last, so writes to different addresses stay
+        # in order, e.g. an LED ring's mode and LED state CCs
+        key = self._key(msg)
+        self._pending.pop(key, None)
+        self._pending[key] = msg
+        if not self._timer.active:
+            try:
+                self._timer.start(self._last_flush + self._interval - now)
+            except RuntimeError:
+                # No event loop running, nobody would flush for us later
+                self.flush()
+
+    def flush(self):
+        self._timer.cancel()
+
+        pending, self._pending = self._pending, {}
+        self._last_flush = time.monotonic()
+        for msg in pending.values():
+            self._write(msg)
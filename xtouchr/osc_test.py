@@ -1,8 +1,9 @@
 import asyncio as aio
-import aiosc
+from xtouchr.oscbatcher import BatchingOSCProtocol
 from xtouchr.osccontrols import OSCToggleSetOnly
+from xtouchr import runtime
 
-class Server(aiosc.OSCProtocol):
+class Server(BatchingOSCProtocol):
     def __init__(self):
         super().__init__(handlers = {'//*': self.echo})
 
@@ -18,4 +19,4 @@ async def main():
     await aio.sleep(100.0)
 
 if __name__ == '__main__':
-    aio.get_event_loop().run_until_complete(main())
\ No newline at end of file
+    runtime.run(main())
\ No newline at end of file
@@ -0,0 +1,103 @@
+import asyncio as aio
+import typing as ty
+import aiosc
+
+
+class BatchingOSCProtocol(aiosc.OSCProtocol):
+    """
+    OSC protocol that collects all messages sent within one event loop
+    iteration and sends them together as OSC bundles of at most MTU bytes.
+
+    A message supersedes an earlier pending one to the same path with the
+    same arguments except the last one (the value), so only the latest value
+    is sent, in the place of the latest write. Paths that trigger actions,
+    like '/jog', should be excluded from this with no_coalesce.
+
+    Handlers for plain paths, like the ones OSCRouter adds, are found with one
+    dict lookup on the incoming path. Only handlers for patterns such as '//*'
+    are matched against every message.
+    """
+    MTU = 1472
+    BUNDLE_HEADER_SIZE = 16     # '#bundle' and the time tag
+
+    PATTERN_CHARS = frozenset('?*[{')
+
+    def __init__(self, handlers=None):
+        # Before aiosc adds the handlers given here
+        self._paths: ty.Dict[str, ty.List[ty.Callable]] = {}
+        super().__init__(handlers=handlers)
+        self._pending: ty.Dict[ty.Hashable, ty.Tuple[str, ty.Tuple, ty.Any]] = {}
+        self._no_coalesce: ty.Set[str] = set()
+        self._seq = 0
+        self._scheduled = False
+
+    def add_handler(self, pattern: str, handler: ty.Callable):
+        if '//' in pattern or not self.PATTERN_CHARS.isdisjoint(pattern):
+            super().add_handler(pattern, handler)
+        else:
+            self._paths.setdefault(pattern, []).append(handler)
+
+    def datagram_received(self, data: bytes, addr):
+        if data.startswith(b'#bundle'):
+            messages = aiosc.parse_bundle(data)
+        else:
+            messages = [aiosc.parse_message(data)]
+
+        for path, args in messages:
+            for handler in self._paths.get(path, ()):
+                handler(addr, path, *args)
+            for pattern_re, handler in self._handlers:
+                if pattern_re.match(path):
+                    handler(addr, path, *args)
+
+    def no_coalesce(self, path: str):
+        self._no_coalesce.add(path)
+
+    def send(self, path: str, *args, addr=None):
+        if path in self._no_coalesce:
+            self._seq += 1
+            key = (addr, self._seq)
+        else:
+            key = (addr, path, args[:-1])
+            # Goes out in the order of the latest values
+            self._pending.pop(key, None)
+        self._pending[key] = (path, args, addr)
+
+        if not self._scheduled:
+            self._scheduled = True
+            aio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self._scheduled = False
+        pending, self._pending = self._pending, {}
+        packets: ty.Dict[ty.Any, ty.List[ty.Tuple[str, ty.Tuple]]] = {}
+        for path, args, addr in pending.values():
+            packets.setdefault(addr, []).append((path, args))
+
+        for addr, msgs in packets.items():
+            for packet in self._bundles(msgs):
+                self.transport.sendto(packet, addr)
+
+    def _bundles(self, msgs: ty.List[ty.Tuple[str, ty.Tuple]]) -> ty.Iterator[bytes]:
+        bundle = []
+        last = b''
+        size = self.BUNDLE_HEADER_SIZE
+        for path, args in msgs:
+            packed = aiosc.pack_message(path, *args)
+            if bundle and size + 4 + len(packed) > self.MTU:
+                yield self._pack(bundle, last)
+                bundle = []
+                size = self.BUNDLE_HEADER_SIZE
+            bundle.append((path, *args))
+            size += 4 + len(packed)
+            last = packed
+
+        if bundle:
+            yield self._pack(bundle, last)
+
+    @staticmethod
+    def _pack(bundle: ty.List[tuple], last: bytes) -> bytes:
+        if len(bundle) == 1:
+            # No need for a bundle, last is the message packed already
+            return last
+        return aiosc.pack_bundle(bundle)
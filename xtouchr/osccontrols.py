@@ -1,65 +1,133 @@
 from xtouchr.controls import Control
-import aiosc
+from xtouchr.timers import Throttle
+from xtouchr.oscrouter import OSCRouter
+from xtouchr.tracing import TRACER
+from xtouchr.recorder import RECORDER
+from xtouchr.metrics import METRICS
 import time
+import typing as ty
+from collections import deque
+
+if ty.TYPE_CHECKING:
+    import aiosc
+
+def _send_osc(osc: "aiosc.OSCProtocol", path: str, *args):
+    if TRACER.enabled:
+        TRACER.mark('osc')
+    if RECORDER.active:
+        RECORDER.osc_out(path, args)
+    if METRICS.enabled:
+        METRICS.count(METRICS.osc_out, path)
+    osc.send(path, *args)
 
 class ReplyFilter:
-    def __init__(self, maxage = 1.0):
-        self._replies = list()
+    """
+    Remembers values that were sent out, so their echo from the DAW can be
+    told apart from changes made on the DAW side.
+
+    Sent values expire after maxage seconds and at most maxlen of them are
+    kept. Values are counted in buckets, so both add_sent and is_reply are
+    (amortized) O(1). hits, misses and expired count what happened to them.
+    """
+    def __init__(self, maxage = 1.0, maxlen = 64):
         self._maxage = maxage
+        self._maxlen = maxlen
+        self._sent: ty.Deque[ty.Tuple[float, ty.Hashable]] = deque()    # (time, bucket), oldest first
+        self._live: ty.Dict[ty.Hashable, int] = {}          # Unmatched entries per bucket
+        self._consumed: ty.Dict[ty.Hashable, int] = {}      # Matched entries per bucket still in _sent
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        METRICS.filters.add(self)
+
+    def _bucket(self, val) -> ty.Hashable:
+        return val
 
-    def _check_eq(self, a, b):
-        return a == b
+    def _candidates(self, val) -> ty.Iterable[ty.Hashable]:
+        return (val,)
 
     def add_sent(self, val):
-        self._replies.append((time.time(), val))
+        now = time.monotonic()
+        self._expire(now)
+        if len(self._sent) >= self._maxlen:
+            self._drop_oldest()
+
+        bucket = self._bucket(val)
+        self._sent.append((now, bucket))
+        self._live[bucket] = self._live.get(bucket, 0) + 1
 
-    def _filter_old(self):
-        now = time.time()
-        self._replies = list(filter(lambda a: now-a[0] < self._maxage, self._replies))
+    def _expire(self, now: float):
+        limit = now - self._maxage
+        while self._sent and self._sent[0][0] <= limit:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        _, bucket = self._sent.popleft()
+        if self._consumed.get(bucket, 0):
+            # The reply for this one has already arrived
+            self._decrement(self._consumed, bucket)
+        else:
+            self._decrement(self._live, bucket)
+            self.expired += 1
+
+    @staticmethod
+    def _decrement(counts: ty.Dict[ty.Hashable, int], bucket: ty.Hashable):
+        count = counts[bucket]
+        if count == 1:
+            del counts[bucket]
+        else:
+            counts[bucket] = count - 1
 
     def is_reply(self, val) -> bool:
-        self._filter_old()
-        reply = next(filter(lambda a: self._check_eq(a[1][1], val), enumerate(self._replies)), None)
-        if reply is not None:
-            del self._replies[reply[0]]
-            print("Reply found!")
-            return True
-
-        print("No reply found!")
+        if self._sent:
+            self._expire(time.monotonic())
+        for bucket in self._candidates(val):
+            if bucket in self._live:
+                self._decrement(self._live, bucket)
+                self._consumed[bucket] = self._consumed.get(bucket, 0) + 1
+                self.hits += 1
+                return True
+
+        self.misses += 1
         return False
 
 class ReplyFilterFloat(ReplyFilter):
-    def __init__(self, maxage = 1.0, limit = 0.0001):
-        super().__init__(maxage)
+    """
+    Matches floats that are within about limit of a sent value. Values are
+    quantized to buckets of width limit and the neighbouring buckets are
+    checked as well.
+    """
+    def __init__(self, maxage = 1.0, limit = 0.0001, maxlen = 64):
+        super().__init__(maxage, maxlen)
         self._limit = limit
 
-    def _check_eq(self, a, b):
-        return (abs(a-b) < self._limit)
+    def _bucket(self, val) -> int:
+        return round(val / self._limit)
+
+    def _candidates(self, val) -> ty.Iterable[int]:
+        bucket = round(val / self._limit)
+        return (bucket, bucket - 1, bucket + 1)
 
 class OSCToggleBase(Control):
-    def __init__(self, osc: aiosc.OSCProtocol, path: str, *args):
+    __slots__ = ('osc', 'path', 'checked_args', '_on')
+
+    def __init__(self, osc: "aiosc.OSCProtocol", path: str, *args):
         super().__init__()
         self.osc = osc
         self.path = path
         self.checked_args = args
-        self.osc.add_handler(self.path, self.osc_callback)
+        OSCRouter.of(self.osc).add(self.path, self.checked_args, self.osc_callback)
         self._on = False    # Tracks state of control within OSC endpoint
 
     def osc_callback(self, _addr, _path, *args):
-        incoming_args = args[:-1]
+        # The router only calls us for our own checked_args
         new_on = bool(args[-1])
-        if len(incoming_args) != len(self.checked_args):
-            # Message is not for us
-            return
-
-        if any(ca != ia for ca, ia in zip(self.checked_args, incoming_args)):
-            # Message is not for us (e.g. other fader ID)
-            return
-
         with self.maybe_notify() as m:
             self._on = m.assign(self._on, new_on, 'on')
 
 class OSCToggle(OSCToggleBase):
+    __slots__ = ()
+
     @property
     def on(self) -> bool:
         return self._on
@@ -72,13 +140,15 @@ class OSCToggle(OSCToggleBase):
             self._update_osc()
 
     def _update_osc(self):
-        self.osc.send(self.path, *self.checked_args, float(self._on))
+        _send_osc(self.osc, self.path, *self.checked_args, float(self._on))
 
 class OSCToggleSetOnly(OSCToggleBase):
     """
     Used for OSC properties that can go on and off, but can only be
     turned on using the control
     """
+    __slots__ = ()
+
     @property
     def on(self) -> bool:
         return self._on
@@ -95,35 +165,50 @@ class OSCToggleSetOnly(OSCToggleBase):
 
     def _update_osc(self):
         if (self._on):
-            self.osc.send(self.path, *self.checked_args, float(self._on))
+            _send_osc(self.osc, self.path, *self.checked_args, float(self._on))
 
 class OSCFader(Control):
     """
     Used to read and write float values
+
+    With a rate (in Hz), at most that many values per second are sent. The
+    first change is sent immediately, changes within the following interval
+    are coalesced and the latest value is always sent when it is over.
+
+    With quantize, a function mapping the value to what is displayed of it,
+    feedback that would not change the displayed value only updates value and
+    does not notify anybody.
     """
-    def __init__(self, osc: aiosc.OSCProtocol, path: str, *args):
+    __slots__ = ('osc', 'path', 'checked_args', 'filter', 'quantize', '_value', '_pending', '_quantized',
+                 '_wait_ack_t', '_wait_ack_val', '_wait_ack_more', '_throttle')
+
+    def __init__(self, osc: "aiosc.OSCProtocol", path: str, *args, rate: ty.Optional[float] = None,
+                 quantize: ty.Optional[ty.Callable[[float], ty.Hashable]] = None):
         super().__init__()
         self.osc = osc
         self.path = path
         self.checked_args = args
-        self.osc.add_handler(self.path, self.osc_callback)
+        OSCRouter.of(self.osc).add(self.path, self.checked_args, self.osc_callback)
         self.filter = ReplyFilterFloat()
         self._value = 0.0    # Tracks fader value within OSC endpoint
+        self._pending = 0.0  # Latest local value, what the next send goes out with
+        self.quantize = quantize
+        self._quantized = quantize(self._value) if quantize is not None else None
         self._wait_ack_t = 0.0          # Time when we started waiting for ACKs
         self._wait_ack_val = 0.0        # Value that we wait for to be acknowledged
         self._wait_ack_more = False     # Whether there is more after this ack
+        self._throttle = Throttle(self._send, rate)
 
     def osc_callback(self, _addr, _path, *args):
-        incoming_args = args[:-1]
+        # The router only calls us for our own checked_args
         new_val = float(args[-1])
-        if len(incoming_args) != len(self.checked_args):
-            # Message is not for us
-            return
-
-        if any(ca != ia for ca, ia in zip(self.checked_args, incoming_args)):
-            # Message is not for us (e.g. other fader ID)
-            return
-
+        if self.quantize is not None:
+            quantized = self.quantize(new_val)
+            if quantized == self._quantized:
+                # Nothing would change on the surface
+                self._value = new_val
+                return
+            self._quantized = quantized
         if self.filter.is_reply(new_val) or True:
             with self.maybe_notify() as m:
                 self._value = m.assign(self._value, new_val, 'value')            
@@ -135,34 +220,35 @@ class OSCFader(Control):
     @value.setter
     def value(self, val: float):
         if (self._value != val):
+            if self.quantize is not None:
+                self._quantized = self.quantize(val)
             with self.maybe_notify() as m:
                 self._value = m.assign(self._value, val, 'value')
+            self._pending = val
             self._update_osc()
 
     def _update_osc(self):
-        self.filter.add_sent(self._value)
-        self.osc.send(self.path, *self.checked_args, float(self._value))
+        self._throttle.request()
+
+    def _send(self):
+        # Feedback may have replaced _value while the trailing send was waiting
+        self.filter.add_sent(self._pending)
+        _send_osc(self.osc, self.path, *self.checked_args, float(self._pending))
 
 class OSCValue(Control):
-    def __init__(self, osc: aiosc.OSCProtocol, path: str, *args, initial=None):
+    __slots__ = ('osc', 'path', 'checked_args', '_value')
+
+    def __init__(self, osc: "aiosc.OSCProtocol", path: str, *args, initial=None):
         super().__init__()
         self.osc = osc
         self.path = path
         self.checked_args = args
-        self.osc.add_handler(self.path, self.osc_callback)
+        OSCRouter.of(self.osc).add(self.path, self.checked_args, self.osc_callback)
         self._value = initial
 
     def osc_callback(self, _addr, _path, *args):
-        incoming_args = args[:-1]
+        # The router only calls us for our own checked_args
         new_value = args[-1]
-        if len(incoming_args) != len(self.checked_args):
-            # Message is not for us
-            return
-
-        if any(ca != ia for ca, ia in zip(self.checked_args, incoming_args)):
-            # Message is not for us (e.g. other fader ID)
-            return
-
         with self.maybe_notify() as m:
             self._value = m.assign(self._value, new_value, 'on')    
 
@@ -171,11 +257,16 @@ class OSCValue(Control):
         return self._value
 
 class OSCAction(Control):
-    def __init__(self, osc: aiosc.OSCProtocol, path: str, *args):
+    __slots__ = ('osc', 'path', 'args')
+
+    def __init__(self, osc: "aiosc.OSCProtocol", path: str, *args):
         super().__init__()
         self.osc = osc
         self.path = path
         self.args = args
+        if hasattr(self.osc, 'no_coalesce'):
+            # Every action counts, they must not supersede each other
+            self.osc.no_coalesce(self.path)
 
     def action(self, *args):
-        self.osc.send(self.path, *self.args, *args)
\ No newline at end of file
+        _send_osc(self.osc, self.path, *self.args, *args)
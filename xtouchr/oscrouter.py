@@ -0,0 +1,76 @@
+import typing as ty
+import weakref
+from xtouchr import tracing
+from xtouchr.recorder import RECORDER
+from xtouchr.metrics import METRICS
+
+if ty.TYPE_CHECKING:
+    import aiosc
+
+
+class OSCRouter:
+    """
+    Routes incoming OSC messages directly to the controls that own them.
+
+    Only a single handler is added to the protocol for every path. Messages
+    are dispatched with one dict lookup on all arguments except the last one,
+    which is the value, e.g. the strip ID for '/strip/fader'. Use OSCRouter.of
+    to get the router shared by all controls of a protocol. BatchingOSCProtocol
+    looks up the handler of a path in a dict as well, other protocols match
+    the message against all handlers in turn.
+
+    Callbacks passed to on_next are called once, on the next routed message
+    of any path.
+    """
+    _routers: "weakref.WeakKeyDictionary[aiosc.OSCProtocol, OSCRouter]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, osc: "aiosc.OSCProtocol"):
+        self.osc = osc
+        self._routes: ty.Dict[str, ty.Dict[ty.Tuple, ty.List[ty.Callable]]] = {}
+        self._next: ty.List[ty.Callable[[], None]] = []
+
+    @classmethod
+    def of(cls, osc: "aiosc.OSCProtocol") -> "OSCRouter":
+        router = cls._routers.get(osc)
+        if router is None:
+            router = cls._routers[osc] = cls(osc)
+        return router
+
+    def add(self, path: str, args: ty.Sequence, callback: ty.Callable):
+        routes = self._routes.get(path)
+        if routes is None:
+            routes = self._routes[path] = {}
+            self.osc.add_handler(path, self._build_handler(routes))
+
+        routes.setdefault(tuple(args), []).append(callback)
+
+    def on_next(self, callback: ty.Callable[[], None]):
+        self._next.append(callback)
+
+    def _build_handler(self, routes: ty.Dict[ty.Tuple, ty.List[ty.Callable]]) -> ty.Callable:
+        waiting = self._next
+
+        def handler(addr, path, *args):
+            if not args:
+                return
+            if waiting:
+                once = waiting[:]
+                waiting.clear()
+                for cb in once:
+                    cb()
+            if RECORDER.active:
+                RECORDER.osc_in(path, args)
+            if METRICS.enabled:
+                METRICS.count(METRICS.osc_in, path)
+            cbs = routes.get(args[:-1])
+            if cbs is None:
+                return
+
+            if tracing.TRACER.enabled:
+                tracing.TRACER.begin('osc', tracing.now())
+            try:
+                for cb in cbs:
+                    cb(addr, path, *args)
+            finally:
+                tracing.TRACER.end()
+        return handler
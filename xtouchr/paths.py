@@ -0,0 +1,4 @@
+import os
+
+# Compiled mappings and the last working MIDI ports are cached here
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'xtouchr')
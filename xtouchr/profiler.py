@@ -0,0 +1,148 @@
+import logging
+import typing as ty
+from time import perf_counter
+
+log = logging.getLogger(__name__)
+
+
+class ListenerStats:
+    __slots__ = ('control', 'listener', 'count', 'total', 'own', 'max')
+
+    def __init__(self, control: str, listener: str):
+        self.control = control
+        self.listener = listener
+        self.count = 0
+        self.total = 0.0    # Including listeners of controls changed by this one
+        self.own = 0.0      # Excluding them
+        self.max = 0.0      # Longest own time of a single call
+
+    def add(self, total: float, own: float):
+        self.count += 1
+        self.total += total
+        self.own += own
+        if own > self.max:
+            self.max = own
+
+
+def describe(ctrl: ty.Any) -> str:
+    """
+    Names a control by its class and what it is bound to, e.g.
+    'OSCFader /strip/fader 3' or 'LEDFader cc 3'. Controls made of other
+    controls are named after their main part.
+    """
+    name = type(ctrl).__qualname__
+    path = getattr(ctrl, 'path', None)
+    if path is not None:
+        args = getattr(ctrl, 'checked_args', None) or getattr(ctrl, 'args', ())
+        return ' '.join([name, path, *map(str, args)])
+    for attr in ('cc', 'note'):
+        number = getattr(ctrl, attr, None)
+        if number is not None:
+            return f"{name} {attr} {number}"
+    for attr in ('fader', 'led_button', 'button', 'surface'):
+        part = getattr(ctrl, attr, None)
+        if part is not None:
+            return f"{name} ({describe(part)})"
+    return f"{name} {id(ctrl):#x}"
+
+
+class Profiler:
+    """
+    Samples how long the listeners called from Control.notify take.
+
+    Every n-th top level notify is sampled, together with all notifies its
+    listeners cause, so the time a listener spends in other controls'
+    listeners can be told apart from its own. Stats are kept per control
+    instance and listener, so a single misbehaving strip stands out; controls
+    are named by their OSC path and arguments or MIDI CC or note. A listener whose own time exceeds the budget is logged
+    with the chain of notifies that led to it, once the sampled notify is
+    done, so logging is not counted against the listeners still running.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.every = 16
+        self.budget = 0.002
+        self.stats: ty.Dict[ty.Tuple[int, str], ListenerStats] = {}
+        self._countdown = 0
+        self._depth = 0                     # Nesting of unsampled notifies
+        self._chain: ty.List[str] = []      # Listeners currently running in a sampled notify
+        self._nested: ty.List[float] = []   # Time spent in nested listeners, per chain entry
+        self._slow: ty.List[ty.Tuple[float, str]] = []     # Slow listeners to log, (own, chain)
+
+    def enable(self, enabled: bool = True, every: int = 16, budget: float = 0.002):
+        self.enabled = enabled
+        self.every = every
+        self.budget = budget
+
+    def reset(self):
+        self.stats.clear()
+
+    def notify(self, ctrl: ty.Any, args: tuple):
+        if not self._chain:
+            if self._depth:
+                # Caused by an unsampled notify, not sampled either
+                self._skip(ctrl, args)
+                return
+            self._countdown -= 1
+            if self._countdown > 0:
+                self._skip(ctrl, args)
+                return
+            self._countdown = self.every
+
+        control = None
+        for l in ctrl.listeners:
+            listener = getattr(l, '__qualname__', None) or repr(l)
+            stats = self.stats.get((id(ctrl), listener))
+            if stats is None:
+                if control is None:
+                    control = describe(ctrl)
+                stats = self.stats[(id(ctrl), listener)] = ListenerStats(control, listener)
+            self._chain.append(f"{stats.control} -> {listener}")
+            self._nested.append(0.0)
+            t0 = perf_counter()
+            try:
+                l(*args)
+            finally:
+                total = perf_counter() - t0
+                own = total - self._nested.pop()
+                if own > self.budget:
+                    self._slow.append((own, ' => '.join(self._chain)))
+                self._chain.pop()
+                if self._nested:
+                    self._nested[-1] += total
+                stats.add(total, own)
+                if self._slow and not self._chain:
+                    self._log_slow()
+
+    def _log_slow(self):
+        for own, chain in self._slow:
+            log.warning("Slow listener took %.1fms (budget %.1fms): %s", own * 1e3, self.budget * 1e3, chain)
+        self._slow.clear()
+
+    def _skip(self, ctrl: ty.Any, args: tuple):
+        self._depth += 1
+        try:
+            for l in ctrl.listeners:
+                l(*args)
+        finally:
+            self._depth -= 1
+
+    def top(self, n: int = 10, key: str = 'own') -> ty.List[ListenerStats]:
+        """
+        Returns the stats of the n (control, listener) pairs with the highest
+        key, one of 'own', 'total', 'max' or 'count'
+        """
+        return sorted(self.stats.values(), key=lambda s: getattr(s, key), reverse=True)[:n]
+
+    def report(self, n: int = 10) -> str:
+        lines = []
+        for key in ('own', 'max'):
+            lines.append(f"top {n} listeners by {key} time (1 in {self.every} notifies sampled):")
+            for s in self.top(n, key):
+                lines.append(f"    {s.control} -> {s.listener}: n={s.count} own={s.own * 1e3:.2f}ms "
+                             f"total={s.total * 1e3:.2f}ms max={s.max * 1e6:.0f}us")
+        return '\n'.join(lines)
+
+
+PROFILER = Profiler()
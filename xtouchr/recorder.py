@@ -0,0 +1,167 @@
+"""
+Records MIDI and OSC traffic into a compact binary log and replays it.
+
+The log starts with MAGIC, followed by one record per message: the time since
+the start of the recording (float64), the kind of record (uint8), the length
+of the payload (uint16), all little endian, and the payload itself. MIDI
+payloads are the plain message bytes, OSC payloads are packed OSC messages.
+
+    python -m xtouchr.recorder session.xtr
+"""
+import asyncio as aio
+import collections
+import struct
+import sys
+import threading
+import time
+import typing as ty
+
+if ty.TYPE_CHECKING:
+    import aiosc
+    import mido
+    from xtouchr.mididevice import MidiDevice
+
+MAGIC = b'XTRC\x01'
+RECORD = struct.Struct('<dBH')
+
+MIDI_IN = 1
+MIDI_OUT = 2
+OSC_IN = 3
+OSC_OUT = 4
+KINDS = {MIDI_IN: 'midi_in', MIDI_OUT: 'midi_out', OSC_IN: 'osc_in', OSC_OUT: 'osc_out'}
+
+
+class Recorder:
+    """
+    Writes a traffic log. Records are only appended to a buffer where they
+    happen, MIDI input e.g. on the MIDI backend's thread, and written to the
+    file by a writer thread every INTERVAL seconds, so a slow disk never
+    holds up the MIDI backend or the event loop.
+    """
+    INTERVAL = 0.1
+
+    def __init__(self):
+        self.active = False
+        self._buffer: ty.Deque[bytes] = collections.deque()
+        self._writer: ty.Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._t0 = 0.0
+
+    def start(self, path: str):
+        self.stop()
+        f = open(path, 'wb')
+        f.write(MAGIC)
+        self._buffer.clear()
+        self._stopping.clear()
+        self._writer = threading.Thread(target=self._write, args=(f,), name='xtouchr-recorder', daemon=True)
+        self._writer.start()
+        self._t0 = time.monotonic()
+        self.active = True
+
+    def stop(self):
+        self.active = False
+        if self._writer is not None:
+            self._stopping.set()
+            self._writer.join()
+            self._writer = None
+
+    def record(self, kind: int, payload: bytes):
+        t = time.monotonic() - self._t0
+        # deque.append is thread safe, the writer takes records from the other end
+        self._buffer.append(RECORD.pack(t, kind, len(payload)) + payload)
+
+    def _write(self, f: ty.BinaryIO):
+        with f:
+            while True:
+                stopping = self._stopping.wait(self.INTERVAL)
+                chunks = []
+                while self._buffer:
+                    chunks.append(self._buffer.popleft())
+                if chunks:
+                    f.write(b''.join(chunks))
+                    f.flush()
+                if stopping:
+                    return
+
+    def midi_in(self, data: ty.Sequence[int]):
+        self.record(MIDI_IN, bytes(data))
+
+    def midi_out(self, msg: "mido.Message"):
+        self.record(MIDI_OUT, bytes(msg.bytes()))
+
+    # aiosc is only loaded once something is recorded
+    def osc_in(self, path: str, args: ty.Sequence):
+        import aiosc
+        self.record(OSC_IN, aiosc.pack_message(path, *args))
+
+    def osc_out(self, path: str, args: ty.Sequence):
+        import aiosc
+        self.record(OSC_OUT, aiosc.pack_message(path, *args))
+
+
+def read_log(path: str) -> ty.Iterator[ty.Tuple[float, int, bytes]]:
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an xtouchr traffic log")
+
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            t, kind, length = RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                # Truncated by a crash while recording
+                return
+            yield t, kind, payload
+
+
+class Replayer:
+    """
+    Replays the incoming traffic of a log into a MidiDevice and an OSC protocol.
+    A speed of 1.0 keeps the original timing, 10.0 is ten times as fast and
+    0 replays as fast as possible.
+    """
+    MAX_DEPTH = 128     # Don't let the MIDI queue fill up and block the loop
+
+    def __init__(self, device: "MidiDevice", osc: "aiosc.OSCProtocol", addr=('127.0.0.1', 3819)):
+        self.device = device
+        self.osc = osc
+        self.addr = addr
+
+    async def replay(self, path: str, speed: float = 1.0) -> int:
+        loop = aio.get_running_loop()
+        start = loop.time()
+        events = 0
+        for t, kind, payload in read_log(path):
+            if speed:
+                delay = start + t / speed - loop.time()
+                if delay > 0.0:
+                    await aio.sleep(delay)
+            while self.device.queue_in.depth >= self.MAX_DEPTH:
+                await aio.sleep(0)
+
+            if kind == MIDI_IN:
+                self.device.queue_in.feed(payload)
+            elif kind == OSC_IN:
+                self.osc.datagram_received(payload, self.addr)
+            else:
+                continue
+            events += 1
+        return events
+
+
+RECORDER = Recorder()
+
+
+def main(path: str):
+    counts = {kind: 0 for kind in KINDS}
+    duration = 0.0
+    for t, kind, _payload in read_log(path):
+        counts[kind] = counts.get(kind, 0) + 1
+        duration = t
+    print(f"{path}: {duration:.1f}s, " + ', '.join(f"{KINDS.get(k, k)}={n}" for k, n in counts.items()))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -0,0 +1,84 @@
+"""
+Event loop setup. run() starts the main coroutine on uvloop when it is
+installed, MidiIOThread gives MIDI output its own thread and loop so writing
+and frame flushing never wait behind the DAW logic on the main loop.
+"""
+import asyncio as aio
+import threading
+import typing as ty
+
+
+def new_event_loop(uvloop: bool = True) -> aio.AbstractEventLoop:
+    """
+    Creates a uvloop loop if uvloop is wanted and installed, a default one otherwise
+    """
+    if uvloop:
+        try:
+            import uvloop as _uvloop
+        except ImportError:
+            pass
+        else:
+            return _uvloop.new_event_loop()
+    return aio.new_event_loop()
+
+
+def run(main: ty.Coroutine, uvloop: bool = True) -> ty.Any:
+    """
+    Runs the coroutine to completion on a new loop, see new_event_loop
+    """
+    # Like asyncio.run, which only takes a loop factory from Python 3.11 on
+    loop = new_event_loop(uvloop)
+    try:
+        aio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            _cancel_tasks(loop)
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            aio.set_event_loop(None)
+            loop.close()
+
+
+def _cancel_tasks(loop: aio.AbstractEventLoop):
+    tasks = aio.all_tasks(loop)
+    if not tasks:
+        return
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(aio.gather(*tasks, return_exceptions=True))
+
+
+class MidiIOThread:
+    """
+    Runs an event loop in a daemon thread. MidiDevices given this thread write
+    to their output port and run their MidiOutScheduler's frame timer on its
+    loop, while input is still dispatched to the controls on the main loop.
+    """
+
+    def __init__(self, uvloop: bool = True, name: str = 'xtouchr-midi-io'):
+        self.loop = new_event_loop(uvloop)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _run(self):
+        aio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        self.loop.close()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def call(self, callback: ty.Callable, *args):
+        """
+        Calls the callback on the I/O thread, can be used from any thread
+        """
+        self.loop.call_soon_threadsafe(callback, *args)
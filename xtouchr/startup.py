@@ -0,0 +1,180 @@
+"""
+Startup helpers to get a restarted surface back in control quickly: the MIDI
+backend is only loaded when the ports are opened, the last ports that worked
+are cached and tried first, and the time to ready is reported per phase.
+PortWatcher reconnects to the ports when the surface is re-plugged.
+"""
+import asyncio as aio
+import contextlib
+import json
+import os
+import typing as ty
+from time import perf_counter
+from xtouchr.paths import CACHE_DIR
+from xtouchr.timers import RepeatingTimer, TIMERS
+
+if ty.TYPE_CHECKING:
+    import mido
+    from xtouchr.mididevice import MidiDevice
+
+PORT_CACHE = os.path.join(CACHE_DIR, 'ports.json')
+BACKEND = 'mido.backends.rtmidi/UNIX_JACK'
+
+
+class StartupTimer:
+    """
+    Collects the duration of the startup phases, in order. Pass start (a
+    perf_counter value) to count what happened before, e.g. imports.
+    """
+    __slots__ = ('start', 'phases')
+
+    def __init__(self, start: ty.Optional[float] = None):
+        self.start = perf_counter() if start is None else start
+        self.phases: ty.List[ty.Tuple[str, float]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, perf_counter() - t0))
+
+    @property
+    def total(self) -> float:
+        return perf_counter() - self.start
+
+    def report(self) -> str:
+        lines = [f"ready in {self.total * 1e3:.1f}ms"]
+        lines += [f"    {name}: {duration * 1e3:.1f}ms" for name, duration in self.phases]
+        return '\n'.join(lines)
+
+
+def _read_port_cache(path: str) -> ty.Dict[str, str]:
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+        return cached if isinstance(cached, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_port_cache(path: str, name_in: str, name_out: str):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'in': name_in, 'out': name_out}, f)
+    except OSError as e:
+        print(f"Could not cache MIDI ports: {e}")
+
+
+def _find(names: ty.Iterable[str], match: str) -> ty.Optional[str]:
+    for name in names:
+        if match in name.lower():
+            return name
+    return None
+
+
+def _open(opener: ty.Callable, name: ty.Optional[str]):
+    if name is None:
+        return None
+    try:
+        return opener(name)
+    except (IOError, OSError):
+        return None
+
+
+def open_ports(match: str = 'x-touch mini', backend: str = BACKEND, cache: ty.Optional[str] = PORT_CACHE,
+               virtual: ty.Tuple[str, str] = ('xtouch-in', 'xtouch-out'),
+               client_name: str = 'xtouchr') -> ty.Tuple["mido.ports.BaseInput", "mido.ports.BaseOutput"]:
+    """
+    Opens the surface's MIDI ports. The cached port names are tried first and
+    the ports are only enumerated if they do not exist anymore. Virtual ports
+    are opened if no port name contains match (case insensitive).
+    """
+    import mido
+    mido.set_backend(backend, load=True)
+    cached = _read_port_cache(cache) if cache is not None else {}
+    pin = _open(mido.open_input, cached.get('in'))
+    pout = _open(mido.open_output, cached.get('out'))
+    if pin is None:
+        pin = _open(mido.open_input, _find(mido.get_input_names(), match))
+    if pout is None:
+        pout = _open(mido.open_output, _find(mido.get_output_names(), match))
+    if pin is not None and pout is not None:
+        if cache is not None and (cached.get('in'), cached.get('out')) != (pin.name, pout.name):
+            _write_port_cache(cache, pin.name, pout.name)
+        return pin, pout
+    if pin is None:
+        pin = mido.open_input(virtual[0], virtual=True, client_name=client_name)
+    if pout is None:
+        pout = mido.open_output(virtual[1], virtual=True, client_name=client_name)
+    return pin, pout
+
+
+class PortWatcher:
+    """
+    Watches for the surface's MIDI ports to go away and come back, e.g. when
+    the X-Touch is re-plugged, and then switches the MidiDevice over to the
+    new ports, which brings the surface back to the controls' state. A device
+    that was missing at startup is picked up the same way.
+    """
+    INTERVAL = 2.0
+
+    def __init__(self, device: "MidiDevice", match: str = 'x-touch mini', backend: str = BACKEND,
+                 cache: ty.Optional[str] = PORT_CACHE, interval: float = INTERVAL):
+        self.device = device
+        self.match = match
+        self.backend = backend
+        self.cache = cache
+        self.interval = interval
+        self.lost = False
+        self.reconnects = 0
+        self._listing: ty.Optional[aio.Future] = None
+        self._timer = RepeatingTimer(self._check)
+
+    def start(self):
+        self._timer.start(self.interval, self.interval)
+
+    def stop(self):
+        self._timer.cancel()
+
+    def _check(self):
+        rt = getattr(self.device.midi_in, '_rt', None)
+        if rt is not None:
+            # Asks the open port's client, mido.get_input_names() would
+            # register two new clients with JACK / ALSA on every check
+            self._update(rt.get_ports())
+        elif self._listing is None:
+            import mido
+            self._listing = TIMERS.loop.run_in_executor(None, mido.get_input_names)
+            self._listing.add_done_callback(self._listed)
+
+    def _listed(self, listing: aio.Future):
+        self._listing = None
+        if self._timer.active and not listing.cancelled() and listing.exception() is None:
+            self._update(listing.result())
+
+    def _update(self, names: ty.List[str]):
+        name = _find(names, self.match)
+        current = self.device.midi_in.name
+        if name is None:
+            if not self.lost and self.match in current.lower():
+                self.lost = True
+                print(f"MIDI port {current} is gone, waiting for it to come back")
+            return
+        if name == current and not self.lost:
+            return
+        self._reconnect()
+
+    def _reconnect(self):
+        # The device closes the old output port itself, it may be in use on the io thread
+        try:
+            self.device.midi_in.close()
+        except (IOError, OSError):
+            pass
+        midi_in, midi_out = open_ports(self.match, self.backend, self.cache)
+        self.lost = False
+        self.reconnects += 1
+        print(f"Reconnected to MIDI ports {midi_in.name} / {midi_out.name}")
+        self.device.reconnect(midi_in, midi_out)
@@ -0,0 +1,198 @@
+import asyncio as aio
+import math
+import threading
+import time
+import typing as ty
+
+
+class TimerService:
+    """
+    Shared bookkeeping for all Timers and RepeatingTimers. Timers may run on
+    the loops of several threads (see MidiIOThread), so the running timers
+    are tracked under a lock.
+    """
+    # Handles may fire up to the loop's clock resolution early
+    SLACK = 0.001
+
+    def __init__(self):
+        self._running: ty.Set[ty.Union["Timer", "RepeatingTimer"]] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> int:
+        # Number of timers currently running
+        return len(self._running)
+
+    def started(self, timer: ty.Union["Timer", "RepeatingTimer"]):
+        with self._lock:
+            self._running.add(timer)
+
+    def stopped(self, timer: ty.Union["Timer", "RepeatingTimer"]):
+        with self._lock:
+            self._running.discard(timer)
+
+    def cancel_all(self):
+        """
+        Cancels every running timer, e.g. when a control graph is torn down
+        """
+        with self._lock:
+            running = list(self._running)
+        for timer in running:
+            timer.cancel()
+
+    @property
+    def loop(self) -> aio.AbstractEventLoop:
+        # Timers run on the loop of the thread they are used in
+        return aio.get_running_loop()
+
+
+TIMERS = TimerService()
+
+
+class Timer:
+    """
+    One-shot timer whose deadline can be pushed out without handle churn.
+
+    start() sets the deadline. If the timer is already armed for an earlier
+    point in time, that is just a field update: the armed handle notices
+    on firing that the deadline moved and re-arms itself for the rest of the
+    time. cancel() only clears the deadline, the stale handle fires as a no-op
+    or is reused by the next start().
+    """
+    __slots__ = ('_callback', '_deadline', '_handle', '_armed_at')
+
+    def __init__(self, callback: ty.Callable[[], ty.Any]):
+        self._callback = callback
+        self._deadline: ty.Optional[float] = None
+        self._handle: ty.Optional[aio.TimerHandle] = None
+        self._armed_at = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._deadline is not None
+
+    def start(self, delay: float):
+        loop = TIMERS.loop
+        if self._deadline is None:
+            TIMERS.started(self)
+        self._deadline = loop.time() + delay
+        if self._handle is not None:
+            if self._armed_at <= self._deadline:
+                return
+            # Deadline moved closer, the armed handle would be too late
+            self._handle.cancel()
+        self._arm(loop)
+
+    def cancel(self):
+        if self._deadline is not None:
+            self._deadline = None
+            TIMERS.stopped(self)
+
+    def _arm(self, loop: aio.AbstractEventLoop):
+        self._armed_at = self._deadline
+        self._handle = loop.call_at(self._deadline, self._fire)
+
+    def _fire(self):
+        self._handle = None
+        if self._deadline is None:
+            return
+
+        loop = TIMERS.loop
+        if self._deadline - loop.time() > TIMERS.SLACK:
+            # Deadline was pushed out in the meantime
+            self._arm(loop)
+            return
+
+        self.cancel()
+        self._callback()
+
+
+class RepeatingTimer:
+    """
+    Calls the callback after an initial delay and then every interval seconds.
+    Ticks are scheduled at fixed points from a monotonic base (base + n *
+    interval), so the time spent in callbacks or the loop does not add up to
+    drift. Ticks that were missed entirely are skipped.
+    """
+    __slots__ = ('_callback', '_handle', '_base', '_interval', '_n')
+
+    def __init__(self, callback: ty.Callable[[], ty.Any]):
+        self._callback = callback
+        self._handle: ty.Optional[aio.TimerHandle] = None
+        self._base = 0.0
+        self._interval = 0.0
+        self._n = 0
+
+    @property
+    def active(self) -> bool:
+        return self._handle is not None
+
+    def start(self, initial: float, interval: float):
+        self.cancel()
+        loop = TIMERS.loop
+        TIMERS.started(self)
+        self._base = loop.time() + initial
+        self._interval = interval
+        self._n = 0
+        self._handle = loop.call_at(self._base, self._fire)
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+            TIMERS.stopped(self)
+
+    def _fire(self):
+        loop = TIMERS.loop
+        self._handle = loop.call_at(self._next(loop.time()), self._fire)
+        self._callback()
+
+    def _next(self, now: float) -> float:
+        self._n += 1
+        when = self._base + self._n * self._interval
+        if when < now:
+            self._n = math.ceil((now - self._base) / self._interval)
+            when = self._base + self._n * self._interval
+        return when
+
+
+class Throttle:
+    """
+    Calls the callback at most rate times per second. The first request()
+    calls it right away, requests within the following interval are coalesced
+    into one trailing call when the interval is over, so the callback always
+    gets to see the latest state. Without a rate, every request() calls it.
+    """
+    __slots__ = ('_callback', '_interval', '_last', '_timer')
+
+    def __init__(self, callback: ty.Callable[[], ty.Any], rate: ty.Optional[float] = None):
+        self._callback = callback
+        self._interval = 1.0 / rate if rate else None
+        self._last = float('-inf')
+        self._timer = Timer(self._call)
+
+    @property
+    def active(self) -> bool:
+        return self._timer.active
+
+    def request(self):
+        if self._interval is None:
+            self._callback()
+            return
+
+        if self._timer.active:
+            # The trailing call picks up the latest state
+            return
+
+        wait = self._last + self._interval - time.monotonic()
+        if wait <= 0.0:
+            self._call()
+        else:
+            self._timer.start(wait)
+
+    def cancel(self):
+        self._timer.cancel()
+
+    def _call(self):
+        self._last = time.monotonic()
+        self._callback()
@@ -0,0 +1,108 @@
+import time
+import typing as ty
+
+now = time.perf_counter
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies with power-of-two buckets in microseconds. Bucket i
+    counts latencies below 2**i us that did not fit into bucket i-1.
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency: float):
+        us = int(latency * 1e6)
+        self.counts[min(us.bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, p: float) -> float:
+        """
+        Returns the upper bound (in seconds) of the bucket holding the p-th percentile
+        """
+        if not self.count:
+            return 0.0
+
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min((1 << i) * 1e-6, self.max)
+        return self.max
+
+    def summary(self) -> ty.Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class Tracer:
+    """
+    Measures the latency from an incoming event to the messages it causes.
+
+    Ingest points call begin() with the time the event arrived and end() once
+    it was dispatched. Since dispatching through the controls, their
+    MaybeNotify/notify and the DAW controls is synchronous, every mark() in
+    between belongs to that event and records the time since its arrival
+    in the histogram for 'source->sink', e.g. 'midi->osc'. Sends made later
+    from timers are not attributed to any event.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms: ty.Dict[str, LatencyHistogram] = {}
+        self._source: ty.Optional[str] = None
+        self._t0 = 0.0
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def begin(self, source: str, t0: float):
+        self._source = source
+        self._t0 = t0
+
+    def end(self):
+        self._source = None
+
+    def mark(self, sink: str):
+        if self._source is None:
+            return
+
+        latency = now() - self._t0
+        key = f"{self._source}->{sink}"
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = LatencyHistogram()
+        hist.add(latency)
+
+    def reset(self):
+        self.histograms.clear()
+
+    def snapshot(self) -> ty.Dict[str, ty.Dict[str, float]]:
+        return {key: hist.summary() for key, hist in self.histograms.items()}
+
+    def report(self) -> str:
+        lines = []
+        for key, s in sorted(self.snapshot().items()):
+            lines.append(f"{key}: n={s['count']} mean={s['mean']*1e3:.3f}ms p50<={s['p50']*1e3:.3f}ms "
+                         f"p90<={s['p90']*1e3:.3f}ms p99<={s['p99']*1e3:.3f}ms max={s['max']*1e3:.3f}ms")
+        return '\n'.join(lines)
+
+
+TRACER = Tracer()
@@ -1,75 +1,122 @@
-import mido
+# Time to ready counts from here, mido, aiosc and the controls are only
+# imported in main
+from time import perf_counter
+_STARTED = perf_counter()
+
 from time import sleep
-from xtouchr.mididevice import MidiDevice
+from xtouchr.tracing import TRACER
+from xtouchr.recorder import RECORDER
+from xtouchr.metrics import METRICS
+from xtouchr.profiler import PROFILER
+import logging
 import asyncio as aio
 import os
 import typing as ty
-import xtouchr.midicontrols as mc
-import xtouchr.dawcontrols as dc
-import xtouchr.osccontrols as oc
-import aiosc
+import xtouchr.startup as startup
+import xtouchr.runtime as runtime
+
+if ty.TYPE_CHECKING:
+    import aiosc
+    import mido
+    from xtouchr.mididevice import MidiDevice
+    from xtouchr.dawcontrols import ArdourConnectGuard
+    from xtouchr.mapping import CompiledMapping
+
+def server_class() -> type:
+    from xtouchr.oscbatcher import BatchingOSCProtocol
 
-class Server(aiosc.OSCProtocol):
-    def __init__(self):
-        super().__init__(handlers = {'//*': self.echo})
+    class Server(BatchingOSCProtocol):
+        def __init__(self):
+            super().__init__(handlers = {'//*': self.echo})
 
-    def echo(self, addr, path, *args):
-        #pass
-        print("incoming message from {}: {} {}".format(addr, path, args))        
+        def echo(self, addr, path, *args):
+            #pass
+            print("incoming message from {}: {} {}".format(addr, path, args))
+    return Server
 
 async def main():
     await aio.sleep(100.0)
 
-def get_xtouch_port_in_name() -> ty.Optional[str]:
-    for name in mido.get_input_names():
-        if "x-touch mini" in name.lower():
-            return name
-    return None
+def build_midi_ports() -> ty.Tuple["mido.ports.BaseInput", "mido.ports.BaseOutput"]:
+    return startup.open_ports()
 
-def get_xtouch_port_out_name() -> ty.Optional[str]:
-    for name in mido.get_output_names():
-        if "x-touch mini" in name.lower():
-            return name
-    return None
+def build_surface(xtouch: "MidiDevice", proto: "aiosc.OSCProtocol",
+                  mapping_path: ty.Optional[str] = None) -> ty.Tuple["CompiledMapping", ty.Dict[str, ty.Any]]:
+    """
+    Wires up all controls of the X-Touch mini with Ardour as described by
+    the mapping file, see xtouchr/mappings/xtouch_mini_ardour.json. Returns
+    the compiled mapping and the controls keyed by name.
+    """
+    import xtouchr.mapping as mapping
+    compiled = mapping.load_mapping(mapping_path or mapping.DEFAULT_MAPPING)
+    return compiled, mapping.build(compiled, xtouch, proto)
 
-def build_midi_ports() -> (mido.ports.BaseInput, mido.ports.BaseOutput):
-    mido.set_backend('mido.backends.rtmidi/UNIX_JACK')
-    name_in = get_xtouch_port_in_name()
-    if name_in is not None:
-        pin = mido.open_input(name_in)
-    else:
-        pin = mido.open_input('xtouch-in', virtual=True, client_name='xtouchr')
+def report_link(guard: "ArdourConnectGuard"):
+    def _connected_cb(notes: dict):
+        if 'connected' in notes:
+            print(guard.health.report())
+    guard.register(_connected_cb)
 
-    name_out = get_xtouch_port_out_name()
-    if name_out is not None:
-        pout = mido.open_output(name_out)
-    else:
-        pout = mido.open_output('xtouch-out', virtual=True, client_name='xtouchr')
-
-    return pin, pout
+def _uvloop() -> bool:
+    return os.environ.get('XTOUCHR_UVLOOP', '1') != '0'
 
 async def main():
-    midi_in, midi_out = build_midi_ports()
-    transport, proto = await aio.get_running_loop().create_datagram_endpoint(Server, local_addr=('*', 9000), remote_addr=('127.0.0.1', 3819))
-    xtouch = MidiDevice(midi_in, midi_out)
-    play_button = mc.LEDButton(xtouch, 22, 14)
-    stop_button = mc.LEDButton(xtouch, 21, 13)
-    play_osc = oc.OSCToggleSetOnly(proto, '/transport_play')
-    stop_osc = oc.OSCToggleSetOnly(proto, '/transport_stop')
-    play_ctl = dc.DAWToggleSetOnly(play_button, play_osc)
-    stop_ctl = dc.DAWToggleSetOnly(stop_button, stop_osc)
-    faders = [dc.ArdourStripFaderControl.build(xtouch, proto, i, i) for i in range(1, 9)]
-    solos = [dc.ArdourSoloMuteControl.build(xtouch, proto, i, i) for i in range(1, 9)]
-    rec = dc.ArdourRecordButton.build(xtouch, proto)
-    loop = dc.ArdourLoopToggle(mc.LEDButton(xtouch, 20, 12), oc.OSCToggle(proto, '/loop_toggle'))
-    fwd = dc.ArdourJogControl(mc.Button(xtouch, 19), oc.OSCAction(proto, '/jog'), True)
-    rew = dc.ArdourJogControl(mc.Button(xtouch, 18), oc.OSCAction(proto, '/jog'), False)
-    master = dc.DAWMainFader(mc.Fader(xtouch, 9), oc.OSCFader(proto, '/master/fader'))
-    conn_action = oc.OSCAction(proto, '/set_surface', 8, 31, 27, 1, 0, 0, 9000)
-    guard = dc.ArdourConnectGuard(conn_action, oc.OSCValue(proto, '/heartbeat'))
-    aio.get_running_loop().create_task(xtouch.start())
+    if os.environ.get('XTOUCHR_TRACE'):
+        # Must be enabled before the MidiDevice is created
+        TRACER.enable()
+    if os.environ.get('XTOUCHR_PROFILE'):
+        # Budget in ms for a single listener, slower ones are logged
+        logging.basicConfig()
+        PROFILER.enable(budget=float(os.environ['XTOUCHR_PROFILE']) / 1e3)
+    if os.environ.get('XTOUCHR_RECORD'):
+        RECORDER.start(os.environ['XTOUCHR_RECORD'])
+    timer = startup.StartupTimer(_STARTED)
+    with timer.phase('imports'):
+        from xtouchr.mididevice import MidiDevice
+        # Loads the control classes, build_surface uses it from there
+        import xtouchr.mapping
+        Server = server_class()
+    with timer.phase('midi ports'):
+        midi_in, midi_out = build_midi_ports()
+    with timer.phase('osc endpoint'):
+        transport, proto = await aio.get_running_loop().create_datagram_endpoint(Server, local_addr=('*', 9000), remote_addr=('127.0.0.1', 3819))
+    with timer.phase('surface'):
+        io = None
+        if os.environ.get('XTOUCHR_MIDI_THREAD'):
+            # MIDI output gets its own thread and loop, the controls stay on this one
+            io = runtime.MidiIOThread(uvloop=_uvloop())
+            io.start()
+        xtouch = MidiDevice(midi_in, midi_out, batch=True, raw=True, frame_rate=60.0, io=io)
+        compiled, controls = build_surface(xtouch, proto, os.environ.get('XTOUCHR_MAPPING'))
+
+        # Ardour pushes its whole state on (re)connect, the controls and the
+        # device's shadow take care of the rest
+        for name in compiled.names('connect_guard'):
+            report_link(controls[name])
+    with timer.phase('start'):
+        aio.get_running_loop().create_task(xtouch.start())
+        xtouch.flush()
+        # Restores the surface when the X-Touch is re-plugged
+        startup.PortWatcher(xtouch).start()
+    print(timer.report())
+    metrics = os.environ.get('XTOUCHR_METRICS')
+    if metrics:
+        # A port number for HTTP on localhost, anything else is a Unix socket path
+        METRICS.enable()
+        if metrics.isdigit():
+            await METRICS.serve(port=int(metrics))
+        else:
+            await METRICS.serve(path=metrics)
     while True:
         await aio.sleep(10.0)
+        if TRACER.enabled:
+            print(TRACER.report())
+        if PROFILER.enabled:
+            print(PROFILER.report())
 
 if __name__ == '__main__':
-    aio.get_event_loop().run_until_complete(main())
\ No newline at end of file
+    try:
+        runtime.run(main(), uvloop=_uvloop())
+    finally:
+        # Writes out what the recorder still buffers
+        RECORDER.stop()